@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+end-to-end bootstrap.main() runs against the fake map server: logins, seeding,
+scanning, parsing and writing into a fresh database, optionally profiled
+
+    python benchmarks/bench_bootstrap.py -m 10 -r 3000 --level 15 --latency 0.05 --density 4
+    python benchmarks/bench_bootstrap.py -r 5000 --level 12 --reach 1000 --adaptive
+    python benchmarks/bench_bootstrap.py -r 5000 --level 12 --reach 800 --adaptive --dedup 0
+    python benchmarks/bench_bootstrap.py --profile cprofile --out bootstrap.prof
+    python benchmarks/bench_bootstrap.py --profile pyinstrument --out bootstrap.html
+"""
+
+import os, sys, time
+import shutil
+import argparse
+import resource
+import sqlite3
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakeapi import FakePGoApi
+from fastmap import apiwrap
+from fastmap.db import QUEUE_FINISHED, status_sql
+from fastmap.pool import AccountPool
+
+import bootstrap
+
+TABLES = ('cells', 'forts', 'spawns', '_spawnlog')
+
+
+def fake_server(args):
+    apiwrap.PGoApi = lambda: FakePGoApi(args.latency, args.jitter, args.density, args.reach)
+    apiwrap.get_encryption_lib_path = lambda: None
+    bootstrap.sleep = lambda s: None
+
+    # logins sleep on purpose, their time is reported apart from the scan,
+    # shard processes log in on their own and count as scan time
+    login = AccountPool.login
+    def timed(self, n):
+        t = time.time(); result = login(self, n); timed.seconds += time.time() - t
+        return result
+    timed.seconds = 0.0
+    AccountPool.login = timed
+    return timed
+
+def run(args, argv):
+    sys.argv = ['bootstrap.py'] + argv
+    if args.profile == 'cprofile':
+        import cProfile, pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(bootstrap.main)
+        profiler.dump_stats(args.out or 'bootstrap.prof')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(args.top)
+    elif args.profile == 'pyinstrument':
+        try: from pyinstrument import Profiler
+        except ImportError: sys.exit('pyinstrument is not installed, use --profile cprofile')
+        profiler = Profiler()
+        profiler.start(); bootstrap.main(); profiler.stop()
+        if args.out:
+            with open(args.out, 'w') as f: f.write(profiler.output_html())
+        print(profiler.output_text())
+    else: bootstrap.main()
+
+def rss_mb():
+    # peak resident set of this process and its shard processes
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024.0 * 1024 if sys.platform == 'darwin' else 1024.0
+    return [x / scale for x in usage]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--minions", help="fake accounts", default=10, type=int)
+    parser.add_argument("-r", "--radius", help="area circle radius", default=3000, type=int)
+    parser.add_argument("--level", help="cell level used for tiling", default=15, type=int)
+    parser.add_argument("-t", "--delay", help="rpc request interval, 0 runs at the server latency", default=0, type=int)
+    parser.add_argument("--processes", help="worker processes", default=1, type=int)
+    parser.add_argument("--route", help="cells per account route", default=20, type=int)
+    parser.add_argument("--window", help="requests in flight at most, shared by all accounts", type=int)
+    parser.add_argument("--latency", help="server latency in s", default=0.05, type=float)
+    parser.add_argument("--jitter", help="random extra latency in s", default=0.02, type=float)
+    parser.add_argument("--density", help="most forts per level 15 cell", default=2, type=int)
+    parser.add_argument("--reach", help="server answers only cells this close to the position, in m", type=int)
+    parser.add_argument("--adaptive", help="split clipped cells into finer ones", action='store_true')
+    parser.add_argument("--dedup", help="dedup cache MB, 0 turns it off", default=32, type=int)
+    parser.add_argument("--profile", help="cprofile or pyinstrument", choices=('cprofile', 'pyinstrument'))
+    parser.add_argument("--out", help="profile output file")
+    parser.add_argument("--top", help="functions shown of the cProfile stats", default=25, type=int)
+    parser.add_argument("--keep", help="keep the work directory", action='store_true')
+    args = parser.parse_args()
+
+    login = fake_server(args)
+    if args.out: args.out = os.path.abspath(args.out)
+    work = tempfile.mkdtemp(prefix='fastmap-bench-')
+    os.chdir(work)
+    with open('accounts.txt', 'w') as f:
+        for i in xrange(args.minions + 2): f.write('bench%03d:secret\n' % i)
+
+    argv = ['-l', '37.235, -115.811', '-r', str(args.radius), '--level', str(args.level), '-m', str(args.minions),
+            '-t', str(args.delay), '--processes', str(args.processes),
+            '--route', str(args.route), '--dedup', str(args.dedup), '--authcache', '', '--dbfile', 'bench.sqlite']
+    if args.window: argv += ['--window', str(args.window)]
+    if args.adaptive: argv += ['--adaptive']
+    t = time.time(); run(args, argv); t = time.time() - t
+
+    db = sqlite3.connect('bench.sqlite')
+    scanned = db.execute("SELECT COUNT(*) FROM _queue WHERE %s" % status_sql(*QUEUE_FINISHED)).fetchone()[0]
+    rows = sum(db.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0] for table in TABLES)
+    levels = db.execute("SELECT cell_level, COUNT(*) FROM _queue GROUP BY cell_level").fetchall()
+    db.close()
+    scan = t - login.seconds
+    print('%d queue cells in %.2fs (%.2fs login, %.2fs scan)' % (scanned, t, login.seconds, scan))
+    print('%.1f cells/s  %.0f rows/s  %d rows' % (scanned / scan, rows / scan, rows))
+    if args.adaptive: print('queue cells per level  ' + '  '.join('%d: %d' % x for x in levels))
+    print('peak RSS %.1f MB, shard processes %.1f MB' % tuple(rss_mb()))
+    if args.keep: print('work directory %s' % work)
+    else: shutil.rmtree(work)
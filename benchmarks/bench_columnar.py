@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+loading all spawns and the spawns of single cells, from SQLite vs. the
+memory-mapped columnar export
+
+    python benchmarks/bench_columnar.py -n 1000000 -q 1000
+"""
+
+import os, sys, time
+import random
+import argparse
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fastmap.db import create_db
+from fastmap.columnar import export_columns, ColumnStore
+from fastmap.query import query_cell
+
+from bench_query import fill, LAT, LNG, SPREAD
+
+
+def timed(name, func, n=1):
+    t = time.time()
+    for dummy in xrange(n): result = func()
+    t = time.time() - t
+    print('%-22s %8.2f ms%s' % (name, 1000 * t / n, '' if n == 1 else ' per query, %d queries' % n))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="spawns in the table", default=1000000, type=int)
+    parser.add_argument("-q", "--queries", help="cell queries", default=1000, type=int)
+    parser.add_argument("--level", help="level of the queried cells", default=15, type=int)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    dbfile = os.path.join(work, 'bench.sqlite')
+    create_db(dbfile); db = fill(dbfile, args.num)
+    t = time.time(); export_columns(db, work, ('spawns',))
+    print('%d spawns exported in %.1fs' % (args.num, time.time() - t))
+
+    rnd = random.Random(7)
+    tokens = [CellId.from_lat_lng(LatLng.from_degrees(LAT + rnd.uniform(-SPREAD, SPREAD), LNG + rnd.uniform(-SPREAD, SPREAD)))
+              .parent(args.level).to_token() for dummy in xrange(args.queries)]
+
+    rows = timed('sqlite all lat/lng', lambda: db.execute("SELECT pos_lat, pos_lng FROM spawns").fetchall())
+    store = timed('mmap open', lambda: ColumnStore(os.path.join(work, 'spawns')))
+    lat = timed('mmap all lat/lng', lambda: (store['lat'], store['lng']))[0]
+    timed('mmap mean latitude', lambda: lat.mean())
+    assert len(rows) == len(lat); del rows
+
+    queries = iter(tokens)
+    n = sum(len(query_cell(db, token)) for token in tokens[:10])
+    timed('sqlite cell', lambda: query_cell(db, next(queries)), len(tokens))
+    queries = iter(tokens)
+    assert n == sum(len(store.select(token, ['lat'])['lat']) for token in tokens[:10])
+    timed('mmap cell', lambda: store.select(next(queries), ['lat', 'lng', 'id']), len(tokens))
+
+    db.close(); del store, lat; shutil.rmtree(work)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+parsing and writing the overlapping responses of dense scan points,
+with and without the dedup cache
+
+    python benchmarks/bench_dedup.py -n 2000 --spacing 70 --budget 32
+"""
+
+import os, sys, time
+import math
+import argparse
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fakeapi import FakePGoApi
+from fastmap import dedup
+from fastmap.db import create_db, connect, DBWriter
+from fastmap.parser import parse_response
+from fastmap.planner import POINT_LEVEL
+from fastmap.utils import EARTH, cell_geometry
+
+LAT, LNG = 37.235, -115.811
+
+
+def scan_points(n, spacing):
+    # a square grid of n points spacing meters apart, visited row by row
+    side = int(math.ceil(math.sqrt(n)))
+    dlat = math.degrees(float(spacing) / EARTH)
+    dlng = dlat / math.cos(math.radians(LAT))
+    return [CellId.from_lat_lng(LatLng.from_degrees(LAT + (k / side) * dlat, LNG + (k % side) * dlng))
+            .parent(POINT_LEVEL).to_token() for k in xrange(n)]
+
+def responses(points, density):
+    api = FakePGoApi(0, 0, density)
+    for token in points:
+        lat, lng, ids = cell_geometry(token)
+        yield token, api.get_map_objects(lat, lng, cell_id=list(ids))
+
+def bench(name, data, budget):
+    dedup.configure(budget)
+    work = tempfile.mkdtemp(); dbfile = os.path.join(work, 'bench.sqlite')
+    create_db(dbfile); db = connect(dbfile); writer = DBWriter(db)
+    tparse = twrite = 0.0; n = 0
+    for token, response in data:
+        t = time.time(); records = parse_response(token, response)[0]; tparse += time.time() - t
+        t = time.time(); writer.write(records); twrite += time.time() - t
+        n += len(records)
+    t = time.time(); writer.flush(); twrite += time.time() - t
+    db.close(); shutil.rmtree(work)
+    print('%-8s %8d records  parse %6.2fs  write %6.2fs' % (name, n, tparse, twrite))
+    if dedup.CACHE is not None: dedup.report()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="scan points", default=2000, type=int)
+    parser.add_argument("--spacing", help="meters between scan points", default=70, type=int)
+    parser.add_argument("--density", help="most forts per level 15 cell", default=4, type=int)
+    parser.add_argument("--budget", help="dedup cache MB", default=32, type=int)
+    args = parser.parse_args()
+
+    import logging; logging.basicConfig(level=logging.INFO, format='%(message)s')
+    data = list(responses(scan_points(args.num, args.spacing), args.density))
+    print('%d responses of %d map cells each' % (len(data), len(data[0][1]['responses']['GET_MAP_OBJECTS']['map_cells'])))
+    bench('no cache', data, 0)
+    bench('dedup', data, args.budget)
+    bench('tiny', data, 0.05)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+lockstep RPC loop vs. per-worker scan engine against the fake map server
+
+    python benchmarks/bench_engine.py -m 10 -c 200 --latency 0.2 --slow 2.0
+"""
+
+import os, sys, time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fakeapi import FakePGoApi
+from fastmap.apiwrap import get_response
+from fastmap.engine import ScanEngine
+from fastmap.utils import get_cell_ids, sub_cells_normalized
+
+
+def make_apis(args):
+    apis = [FakePGoApi(args.latency, args.jitter) for dummy in xrange(args.minions)]
+    apis[0].latency = args.slow
+    return apis
+
+def make_cells(args):
+    cell = CellId.from_lat_lng(LatLng.from_degrees(37.235, -115.811)).parent(args.level)
+    cells = []
+    for dummy in xrange(args.cells):
+        cells.append(cell.to_token()); cell = cell.next()
+    return cells
+
+def run_lockstep(apis, cells, delay):
+    # the old bootstrap.main() loop: one round = one cell per account
+    for r in xrange(0, len(cells), len(apis)):
+        batch = cells[r:r+len(apis)]
+        for i in xrange(len(batch)):
+            time.sleep(float(delay) / len(batch))
+            cell = CellId.from_token(batch[i])
+            latlng = cell.to_lat_lng()
+            get_response(apis[i], get_cell_ids(sub_cells_normalized(cell, 15)),
+                         latlng.lat().degrees, latlng.lng().degrees)
+
+def run_engine(apis, cells, delay):
+    engine = ScanEngine(apis, [None] * len(apis), delay)
+    engine.start(); engine.put(cells)
+    done = 0
+    while done < len(cells):
+        if engine.get() is not None: done += 1
+    engine.stop()
+
+def bench(name, func, args):
+    cells = make_cells(args)
+    t = time.time(); func(make_apis(args), cells, args.delay); t = time.time() - t
+    print('%-9s %5d cells in %7.2fs  %7.2f cells/s' % (name, len(cells), t, len(cells) / t))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--minions", help="fake accounts", default=10, type=int)
+    parser.add_argument("-c", "--cells", help="cells to scan", default=100, type=int)
+    parser.add_argument("-t", "--delay", help="rpc request interval", default=1.0, type=float)
+    parser.add_argument("--level", help="queue cell level", default=12, type=int)
+    parser.add_argument("--latency", help="server latency in s", default=0.1, type=float)
+    parser.add_argument("--jitter", help="random extra latency in s", default=0.05, type=float)
+    parser.add_argument("--slow", help="latency of the slowest account", default=0.5, type=float)
+    args = parser.parse_args()
+
+    bench('lockstep', run_lockstep, args)
+    bench('engine', run_engine, args)
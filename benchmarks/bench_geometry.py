@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+per-scan S2 geometry: old to_lat_lng/sub_cells_normalized path vs. cell_geometry()
+
+    python benchmarks/bench_geometry.py -n 10000 --level 12
+"""
+
+import os, sys, time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fastmap import utils
+from fastmap.utils import cell_geometry, get_cell_ids, sub_cells_normalized
+
+
+def run_old(tokens):
+    for token in tokens:
+        cell = CellId.from_token(token)
+        lat = CellId.to_lat_lng(cell).lat().degrees
+        lng = CellId.to_lat_lng(cell).lng().degrees
+        cell_ids = get_cell_ids(sub_cells_normalized(cell, level=15))
+
+def run_new(tokens):
+    for token in tokens:
+        lat, lng, cell_ids = cell_geometry(token)
+
+def bench(name, func, tokens):
+    t = time.time(); func(tokens); t = time.time() - t
+    print('%-6s %6d cells in %6.3fs  %9.0f cells/s' % (name, len(tokens), t, len(tokens) / t))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="cells in the covering", default=10000, type=int)
+    parser.add_argument("--level", help="queue cell level", default=12, type=int)
+    args = parser.parse_args()
+
+    cell = CellId.from_lat_lng(LatLng.from_degrees(37.235, -115.811)).parent(args.level)
+    tokens = []
+    for dummy in xrange(args.num):
+        tokens.append(unicode(cell.to_token())); cell = cell.next()
+    utils._geometry.maxsize = args.num
+
+    bench('old', run_old, tokens)
+    bench('cold', run_new, tokens)
+    bench('warm', run_new, tokens)
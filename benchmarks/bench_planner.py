@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+scan points of the greedy set cover vs. one scan per occupied level 17 cell
+
+    python benchmarks/bench_planner.py -n 100000
+"""
+
+import os, sys, time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmap.planner import plan_scan_points
+from fastmap.parser import SIGHT_RANGE
+from fastmap.utils import cell_tokens, distance
+
+LAT, LNG = 37.235, -115.811
+
+
+def make_points(n, spread):
+    # spawns cluster along streets and parks
+    rnd = random.Random(42)
+    centres = [(LAT + rnd.uniform(-spread, spread), LNG + rnd.uniform(-spread, spread)) for dummy in xrange(n / 20 + 1)]
+    return [(lat + rnd.gauss(0, 0.0005), lng + rnd.gauss(0, 0.0005)) for lat, lng in (rnd.choice(centres) for dummy in xrange(n))]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="spawns and forts", default=100000, type=int)
+    parser.add_argument("--spread", help="area half width in degrees", default=0.1, type=float)
+    parser.add_argument("--check", help="points checked for coverage", default=2000, type=int)
+    args = parser.parse_args()
+
+    points = make_points(args.num, args.spread)
+    t = time.time(); scanpoints = plan_scan_points(points); t = time.time() - t
+    cells = len(set(cell_tokens(points, 17)))
+    print('%d points: %d scan points in %.2fs, %d occupied level 17 cells (%.1fx the requests)'
+          % (len(points), len(scanpoints), t, cells, float(cells) / len(scanpoints)))
+
+    missed = 0
+    for lat, lng in points[:args.check]:
+        if min(distance(lat, lng, x[0], x[1]) for x in scanpoints) > SIGHT_RANGE + 1: missed += 1
+    print('%d of the first %d points outside every scan circle' % (missed, min(args.check, len(points))))
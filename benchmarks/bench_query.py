@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+area queries through the R*Tree vs. a full scan of pos_lat / pos_lng
+
+    python benchmarks/bench_query.py -n 1000000 -q 100
+"""
+
+import os, sys, time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fastmap.db import create_db, connect, Spawn
+from fastmap.query import query_bbox, query_radius, query_cell
+from fastmap.utils import distance
+
+LAT, LNG, SPREAD = 37.235, -115.811, 0.5
+
+
+def fill(dbfile, n):
+    rnd = random.Random(42)
+    db = connect(dbfile)
+    for k in xrange(0, n, 100000):
+        db.executemany("INSERT OR IGNORE INTO spawns (spawn_id, cell_id, pos_lat, pos_lng, last_scan) VALUES (?,?,?,?,?)",
+                       (('%016x' % (i * 2654435761), '%08x' % (i / 50), LAT + rnd.uniform(-SPREAD, SPREAD),
+                         LNG + rnd.uniform(-SPREAD, SPREAD), 1470000000) for i in xrange(k, min(n, k + 100000))))
+        db.commit()
+    return db
+
+def naive_bbox(db, south, west, north, east):
+    return [Spawn(*row) for row in db.execute("SELECT spawn_id, cell_id, pos_lat, pos_lng, last_scan FROM spawns "
+                                              "WHERE pos_lat BETWEEN ? AND ? AND pos_lng BETWEEN ? AND ?",
+                                              (south, north, west, east))]
+
+def naive_radius(db, lat, lng, radius):
+    return [x for x in naive_bbox(db, -90, -180, 90, 180) if distance(lat, lng, x.pos_lat, x.pos_lng) <= radius]
+
+def bench(name, func, queries):
+    t = time.time(); rows = 0
+    for query in queries: rows += len(func(*query))
+    t = time.time() - t
+    print('%-14s %5d queries in %7.3fs  %8.2f ms/query  %7d rows' % (name, len(queries), t, 1000 * t / len(queries), rows))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="spawns in the table", default=1000000, type=int)
+    parser.add_argument("-q", "--queries", help="queries per kind", default=100, type=int)
+    parser.add_argument("--naive", help="naive queries per kind, they are slow", default=3, type=int)
+    parser.add_argument("--radius", help="query radius in meters", default=500, type=int)
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    dbfile = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    create_db(dbfile)
+    t = time.time(); db = fill(dbfile, args.num)
+    print('%d spawns inserted in %.1fs, R*Tree kept in sync by trigger' % (args.num, time.time() - t))
+
+    points = [(LAT + rnd.uniform(-SPREAD, SPREAD), LNG + rnd.uniform(-SPREAD, SPREAD)) for dummy in xrange(args.queries)]
+    boxes = [(lat, lng, lat + 0.01, lng + 0.01) for lat, lng in points]
+    radii = [(db, lat, lng, args.radius) for lat, lng in points]
+    cells = [(db, CellId.from_lat_lng(LatLng.from_degrees(lat, lng)).parent(15).to_token()) for lat, lng in points]
+
+    n = bench('naive bbox', lambda *box: naive_bbox(db, *box), boxes[:args.naive])
+    assert n == bench('rtree bbox', lambda *box: query_bbox(db, *box), boxes[:args.naive])
+    bench('rtree bbox', lambda *box: query_bbox(db, *box), boxes)
+    n = bench('naive radius', naive_radius, radii[:args.naive])
+    assert n == bench('rtree radius', query_radius, radii[:args.naive])
+    bench('rtree radius', query_radius, radii)
+    bench('rtree cell', query_cell, cells)
+    db.close(); os.remove(dbfile)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+checks fastmap.s2fast against s2sphere bit for bit, then compares throughput
+
+    python benchmarks/bench_s2fast.py -n 100000
+"""
+
+import os, sys, time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s2sphere import CellId, LatLng
+
+from fastmap import s2fast
+
+
+def random_points(n, seed=42):
+    rnd = random.Random(seed)
+    lat = [rnd.uniform(-90, 90) for dummy in xrange(n)]
+    lng = [rnd.uniform(-180, 180) for dummy in xrange(n)]
+    # poles, face edges and corners
+    lat += [90, -90, 0, 0, 0, 0, 45, -45, 35.26438968275465, -35.26438968275465]
+    lng += [0, 0, 0, 90, 180, -180, 45, -135, 45, -135]
+    return lat, lng
+
+def check(lat, lng, levels=(10, 12, 15, 17, 20, 30)):
+    errors = 0
+    leafs = s2fast.leaf_ids(lat, lng)
+    for level in levels:
+        ids = s2fast.parent_ids(leafs, level)
+        tokens = s2fast.to_tokens(ids)
+        clat, clng = s2fast.centres(ids)
+        for k in xrange(len(lat)):
+            cell = CellId.from_lat_lng(LatLng.from_degrees(lat[k], lng[k])).parent(level)
+            center = cell.to_lat_lng()
+            if cell.id() != int(ids[k]) or cell.to_token() != tokens[k] \
+                or center.lat().degrees != clat[k] or center.lng().degrees != clng[k]:
+                errors += 1
+                if errors < 10: print('mismatch at level %d: %r, %r' % (level, lat[k], lng[k]))
+    print('check: %d points x %d levels, %d mismatches' % (len(lat), len(levels), errors))
+    return errors
+
+def run_s2sphere(lat, lng):
+    return [CellId.from_lat_lng(LatLng.from_degrees(lat[k], lng[k])).parent(20).to_token() for k in xrange(len(lat))]
+
+def run_s2fast(lat, lng):
+    return s2fast.to_tokens(s2fast.cell_ids(lat, lng, 20))
+
+def bench(name, func, lat, lng):
+    t = time.time(); func(lat, lng); t = time.time() - t
+    print('%-8s %8d spawn ids in %7.3fs  %10.0f ids/s' % (name, len(lat), t, len(lat) / t))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="random points", default=100000, type=int)
+    parser.add_argument("--check", help="points checked against s2sphere", default=10000, type=int)
+    args = parser.parse_args()
+
+    if check(*random_points(args.check)) > 0: sys.exit(1)
+
+    lat, lng = random_points(args.num, seed=7)
+    bench('s2sphere', run_s2sphere, lat, lng)
+    bench('s2fast', run_s2fast, lat, lng)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+formatted per-row INSERTs vs. DBWriter executemany batches, and what the
+R*Tree and changelog triggers cost the DBWriter
+
+    python benchmarks/bench_writer.py -n 1000000
+"""
+
+import os, sys, time
+import random
+import argparse
+import tempfile
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmap.db import create_db, connect, DBWriter, Spawn
+
+
+def make_spawns(n):
+    rnd = random.Random(42)
+    for i in xrange(n):
+        yield Spawn('%016x' % (i * 2654435761), '%08x' % (i / 50), rnd.uniform(-60, 60), rnd.uniform(-180, 180), 1470000000)
+
+def run_old(dbfile, args):
+    db = sqlite3.connect(dbfile)
+    dbc = db.cursor(); querys = []
+    for s in make_spawns(args.num):
+        querys.append("INSERT OR IGNORE INTO spawns (spawn_id, cell_id, pos_lat, pos_lng, last_scan) "
+                      "VALUES ('{}','{}',{},{},{})".format(s.spawn_id, s.cell_id, s.pos_lat, s.pos_lng, s.last_scan))
+        if len(querys) >= args.batch:
+            for query in querys: dbc.execute(query)
+            db.commit(); querys = []
+    for query in querys: dbc.execute(query)
+    db.commit(); db.close()
+
+def run_new(dbfile, args):
+    db = connect(dbfile)
+    if args.bare:
+        for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+            db.execute("DROP TRIGGER %s" % name)
+    writer = DBWriter(db, args.batch)
+    batch = []
+    for s in make_spawns(args.num):
+        batch.append(s)
+        if len(batch) >= 100: writer.write(batch); batch = []
+    writer.write(batch); writer.flush(); db.close()
+
+def bench(name, func, args):
+    tmp = tempfile.mkdtemp(); dbfile = os.path.join(tmp, 'bench.sqlite')
+    create_db(dbfile)
+    t = time.time(); func(dbfile, args); t = time.time() - t
+    print('%-4s %8d spawns in %7.2fs  %9.0f rows/s' % (name, args.num, t, args.num / t))
+    for f in os.listdir(tmp): os.remove(os.path.join(tmp, f))
+    os.rmdir(tmp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num", help="synthetic spawns", default=1000000, type=int)
+    parser.add_argument("-b", "--batch", help="rows per commit", default=5000, type=int)
+    args = parser.parse_args()
+
+    bench('old', run_old, args)
+    args.bare = True; bench('bare', run_new, args)
+    args.bare = False; bench('new', run_new, args)
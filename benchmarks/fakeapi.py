@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+local stand-in for the PGoApi calls of fastmap.apiwrap, answers login,
+get_player, get_inventory and get_map_objects from synthetic data after
+a configurable latency, density is the most forts per level 15 cell,
+with a reach only cells that close to the position are answered
+"""
+
+import time
+import random
+
+from s2sphere import CellId, LatLng
+
+
+class FakePGoApi(object):
+    def __init__(self, latency=0.1, jitter=0.0, density=2, reach=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.density = density
+        self.reach = reach
+        self.requests = 0
+        self.username = None
+
+    def _wait(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        self.requests += 1
+
+    def set_position(self, lat, lng, alt):
+        self._position = (lat, lng, alt)
+
+    def set_authentication(self, provider=None, username=None, password=None):
+        self.username = username
+
+    def activate_signature(self, lib_path):
+        pass
+
+    def get_player(self):
+        self._wait()
+        return {'status_code': 1, 'responses': {'GET_PLAYER': {'success': True, 'player_data': {'username': self.username}}}}
+
+    def get_inventory(self):
+        self._wait()
+        return {'status_code': 1, 'responses': {'GET_INVENTORY': {'success': True, 'inventory_delta': {'inventory_items': []}}}}
+
+    def get_map_objects(self, latitude=0, longitude=0, since_timestamp_ms=None, cell_id=None):
+        self._wait()
+        now = int(time.time() * 1000)
+        position = LatLng.from_degrees(latitude, longitude)
+        cells = [c for c in cell_id or [] if self.reach is None or
+                 CellId(c).to_lat_lng().get_distance(position).radians * 6371000 <= self.reach]
+        map_cells = [fake_map_cell(c, now, self.density, (latitude, longitude)) for c in cells]
+        return {'status_code': 1, 'responses': {'GET_MAP_OBJECTS': {'status': 1, 'map_cells': map_cells}}}
+
+
+def fake_map_cell(cell_id, timestamp, density, position=None):
+    # same cell always yields the same objects, every spawn point has a fixed
+    # 15 minute window and its pokemon shows within 70m of position
+    rnd = random.Random(cell_id)
+    center = CellId(cell_id).to_lat_lng()
+    lat, lng = center.lat().degrees, center.lng().degrees
+    map_cell = {'s2_cell_id': cell_id, 'current_timestamp_ms': timestamp}
+
+    spawns = [{'latitude': lat + rnd.uniform(-.002, .002), 'longitude': lng + rnd.uniform(-.002, .002)}
+              for dummy in xrange(rnd.randint(0, 2 * density))]
+    if spawns: map_cell['spawn_points'] = spawns
+
+    pokemons = []
+    for spawn in spawns:
+        start, point = rnd.randint(0, 59) * 60000, LatLng.from_degrees(spawn['latitude'], spawn['longitude'])
+        left = 900000 - (timestamp - start) % 3600000
+        if position is None or left <= 0: continue
+        if point.get_distance(LatLng.from_degrees(*position)).radians * 6371000 > 70: continue
+        pokemons.append({'spawn_point_id': CellId.from_lat_lng(point).parent(20).to_token(), 'time_till_hidden_ms': left,
+                         'latitude': spawn['latitude'], 'longitude': spawn['longitude'], 'last_modified_timestamp_ms': timestamp})
+    if pokemons: map_cell['wild_pokemons'] = pokemons
+
+    forts = []
+    for i in xrange(rnd.randint(0, density)):
+        fort = {'id': '%x.%d' % (cell_id, i), 'enabled': True,
+                'latitude': lat + rnd.uniform(-.002, .002), 'longitude': lng + rnd.uniform(-.002, .002)}
+        if rnd.random() < 0.2: fort['gym_points'] = rnd.randint(0, 50000)
+        forts.append(fort)
+    if forts: map_cell['forts'] = forts
+
+    return map_cell
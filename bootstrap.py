@@ -9,20 +9,27 @@ Author: TC    <reddit.com/u/Tr4sHCr4fT>
 Version: 1.5
 """
 
-import os, sys, json
+import os, json, time, socket
 import argparse, logging
-import sqlite3
+import multiprocessing
 
 from time import sleep
+from Queue import Empty
 from pkgutil import find_loader
-from s2sphere.sphere import CellId, LatLng
-from sqlite3 import IntegrityError, ProgrammingError, DataError
-from sqlite3 import OperationalError, InterfaceError, DatabaseError
 
-from pgoapi.exceptions import NotLoggedInException
-from fastmap.db import check_db, fill_db
-from fastmap.apiwrap import api_init, get_response, AccountBannedException
-from fastmap.utils import get_accounts, cover_circle, cover_square, get_cell_ids, sub_cells_normalized, set_bit
+from fastmap.db import check_db, fill_db, connect, QueueSeeder, rescan_cells, ScanHistory, pending_cells, claim_cells, release_cells, renew_leases, reclaim_cells, shard_queue, DBWriter, DBWriterThread
+from fastmap.pool import AccountPool
+from fastmap.authcache import AuthCache
+from fastmap.engine import ScanEngine, WindowEngine
+from fastmap.route import compare_routes
+from fastmap.metrics import serve, MetricsDumper
+from fastmap.planner import load_points, plan_scan_points, queue_scan_points
+from fastmap.spawntimes import update_spawn_times, queue_due_spawns
+from fastmap.maintenance import optimize
+from fastmap.refine import refine_cell, queue_children
+from fastmap import dedup
+from fastmap.shard import ShardProcess
+from fastmap.utils import get_accounts, cover_circle, cover_square, cell_spiral
 
 log = logging.getLogger(__name__)
 
@@ -43,13 +50,30 @@ def init_config():
     parser.add_argument("-l", "--location", help="Location")
     parser.add_argument("-r", "--radius", help="area circle radius", type=int)
     parser.add_argument("-w", "--width", help="area square width", type=int)
+    parser.add_argument("-s", "--spiral", help="spiral around the location, scanning starts while it is seeded", action='store_true', default=0)
     parser.add_argument("--dbfile", help="DB filename", default='db.sqlite')
     parser.add_argument("--accfile", help="ptc account list", default='accounts.txt')
     parser.add_argument("--level", help="cell level used for tiling", default=12, type=int)
+    parser.add_argument("--rescan", help="re-queue cells scanned more than this many hours ago", type=float)
+    parser.add_argument("--plan", help="queue scan points covering the known spawns and forts", action='store_true', default=0)
+    parser.add_argument("--adaptive", help="split cells whose answer came back clipped into finer queue cells", action='store_true', default=0)
+    parser.add_argument("--due", help="queue scan points over the spawns due within this many seconds", type=int)
+    parser.add_argument("--name", help="worker name for queue leases, unique per run", default='%s:%d' % (socket.gethostname(), os.getpid()))
+    parser.add_argument("--lease", help="seconds a claimed cell stays leased, renewed while the run is alive", default=600, type=int)
     parser.add_argument("--maxq", help="maximum queue per worker", default=500, type=int)
     parser.add_argument("--pbar", help="tqdm progressbar", action='store_true', default=1)
     parser.add_argument("-t", "--delay", help="rpc request interval", default=10, type=int)
+    parser.add_argument("--route", help="cells per account route, 0 for one shared queue", default=20, type=int)
+    parser.add_argument("--speed", help="fastest walk between scans in m/s", type=float)
+    parser.add_argument("--mindelay", help="shortest interval the rate control may speed up to, opt-in, the delay is the ceiling otherwise", type=float)
     parser.add_argument("-m", "--minions", help="thread / worker count", default=10, type=int)
+    parser.add_argument("--window", help="requests in flight at most, shared by all accounts instead of a thread each", type=int)
+    parser.add_argument("--authcache", help="session cache file, '' to disable", default='.authcache')
+    parser.add_argument("--spares", help="logged in spare accounts", default=2, type=int)
+    parser.add_argument("--processes", help="worker processes, accounts are split among them", default=1, type=int)
+    parser.add_argument("--dedup", help="MB of memory for skipping objects overlapping responses just recorded, 0 is off", default=32, type=int)
+    parser.add_argument("--metrics", help="serve Prometheus metrics on this local port", type=int)
+    parser.add_argument("--metricsfile", help="dump the metrics as JSON to this file every 10s")
     parser.add_argument("-v", "--verbose", help="Verbose Mode", action='store_true', default=0)    
     parser.add_argument("-d", "--debug", help="Debug Mode", action='store_true', default=0)    
     config = parser.parse_args()
@@ -72,19 +96,44 @@ def init_config():
         logging.getLogger("rpc_api").setLevel(logging.WARNING)
    
     if not check_db(config.dbfile): return     
+    config.seeder = None
+    if config.minions < 1: config.minions = 1
+    if config.processes < 1: config.processes = 1
     
     if config.location:
         from fastmap.utils import get_pos_by_name
         lat, lng, alt = get_pos_by_name(config.location); del alt
-        if config.radius:
+        if config.plan: cells = None
+        elif config.spiral and config.radius:
+            config.seeder = QueueSeeder(config.dbfile, cell_spiral(lat, lng, config.radius, config.level))
+            config.seeder.start(); cells = None
+        elif config.radius:
             cells = cover_circle(lat, lng, config.radius, config.level)
         elif config.width:
             cells = cover_square(lat, lng, config.width, config.level)
         else: log.error('Area size not given!'); return
-        log.info('Added %d items to scan queue.' % fill_db(config.dbfile, cells))
-        del cells, lat, lng
-    
-    if config.minions < 1: config.minions = 1
+        if cells is not None:
+            log.info('Added %d items to scan queue, %d already present.' % fill_db(config.dbfile, cells))
+        del cells
+
+    if config.plan:
+        # overlapping scan points instead of whole cells, only where something is known
+        with connect(config.dbfile) as db:
+            points = load_points(db, lat, lng, config.radius) if config.location and config.radius else load_points(db)
+            scanpoints = plan_scan_points(points)
+            log.info('%d scan points cover %d spawns and forts.' % (len(scanpoints), len(points)))
+            log.info('Added %d items to scan queue, %d already present.' % queue_scan_points(db, scanpoints))
+        del points, scanpoints
+
+    if config.rescan:
+        # the request budget goes to cells whose data can change, at most maxq per worker
+        with connect(config.dbfile) as db:
+            n = rescan_cells(db, int(config.rescan * 3600), config.maxq * config.minions)
+        log.info('Re-queued %d cells for rescan.' % n)
+
+    if config.due:
+        with connect(config.dbfile) as db: n = queue_due_spawns(db, config.due)
+        log.info('Queued %d scan points for spawns due within %ds.' % (n, config.due))
     
     if os.path.isfile('DEBUG'): logging.getLogger(__name__).setLevel(logging.DEBUG)
     
@@ -101,12 +150,22 @@ def main():
         if bar is not None: from fastmap.pbar import TqdmLogHandler
         else: log.warning("'pip install tqdm' to see a fancy progress bar!"); config.pbar = False
     
+    if config.metrics: serve(config.metrics)
+    # before the shard processes fork, each gets its own copy
+    dedup.configure(config.dedup)
+    config.dumper = MetricsDumper(config.metricsfile) if config.metricsfile else None
+    if config.dumper: config.dumper.start()
+
     bar = dummybar()
-    minibar = dummybar()
     minions = config.minions
-    db = sqlite3.connect(config.dbfile)
+    db = connect(config.dbfile)
     log.info('DB loaded.')
-    totalwork  = db.cursor().execute("SELECT COUNT(*) FROM _queue WHERE scan_status=0").fetchone()[0]
+    seeding = config.seeder is not None
+    if seeding: config.seeder.first.wait()
+    # leases of crashed runs come back once expired, live runs keep theirs
+    n = reclaim_cells(db)
+    if n > 0: log.info('Reclaimed %d leased cells.' % n)
+    totalwork  = pending_cells(db)
     
     # some sanity checks   
     if totalwork == 0: log.info('Nothing to scan!'); return
@@ -117,29 +176,31 @@ def main():
         accounts = get_accounts(config.accfile)
         if len(accounts) < config.minions: minions = len(accounts)
 
-    if totalwork < minions: minions = totalwork
+    if totalwork < minions and not seeding: minions = totalwork
     
     workpart = ( totalwork / minions )
     if workpart > config.maxq : workpart = config.maxq
     
+    if config.processes > 1:
+        if seeding: config.seeder.join(); totalwork = pending_cells(db)
+        db.close(); return run_sharded(config, accounts, minions, totalwork)
+
 # all OK?
     done, donetotal = 0, 0
     try:
 # initialize APIs
-        workers = []
-        for m in xrange(minions):
-            log.info('Initializing worker %2d of %2d' % (m+1,minions))
-            api = api_init(accounts[m]); sleep(3)
-            if api is not None:
-                workers.append(api)
-                log.info("Logged into  '%s'" % accounts[m].username)
-            else: log.error("Login failed for  '%s'" % accounts[m].username)
+        log.info('Initializing %2d workers, %d spares' % (minions, config.spares))
+        pool = AccountPool(accounts, config.spares, cache=AuthCache(config.authcache) if config.authcache else None)
+        logged = pool.login(minions)
+        workers, logins = [x[0] for x in logged], [x[1] for x in logged]; del logged
         log.info('Workers:%3d' % len(workers))
+        if len(workers) == 0: log.error('No worker logged in!'); return
+        pool.start()
 # end worker init loop
 
 # ETA
         n = (totalwork / len(workers))
-        log.info('Total %5d cells, %3d Workers, %5d cells each.' % (totalwork, minions, n))
+        log.info('Total %5d cells, %3d Workers, %5d cells each.' % (totalwork, len(workers), n))
         ttot = (n * config.delay + 1); m, s = divmod(ttot, 60); h, m = divmod(m, 60)
         log.info('ETA %d:%02d:%02d' % (h, m, s)); del h,m,s, ttot, minions
 
@@ -153,142 +214,160 @@ def main():
         if config.pbar: import tqdm; log.addHandler(TqdmLogHandler()); bar = tqdm.tqdm(total=totalwork, desc=' total', unit='scan')
 
 # open DB
-        with sqlite3.connect(config.dbfile) as db:  
-            totalstats = [0, 0, 0, 0]  
+        with connect(config.dbfile) as db:  
+            totalstats = [0, 0, 0, 0]
+            inflight = 0
+
+# results are written on a background thread
+            writer = DBWriterThread(config.dbfile)
+            writer.start()
+
+# every account scans on its own thread, or a window of threads serves them all
+            since = ScanHistory(config.dbfile).timestamps if config.rescan else None
+            if config.window: engine = WindowEngine(config.window, workers, logins, config.delay, config.mindelay, pool, since, config.speed)
+            else: engine = ScanEngine(workers, logins, config.delay, config.mindelay, pool, since, config.speed)
+            engine.start()
+            upkeep = time.time() + config.lease / 3
 
 ## main loop        
-            while donetotal < totalwork and len(workers) > 0:
+            while (donetotal < totalwork or seeding) and engine.alive() > 0 and writer.is_alive():
 ##
-                done = 0
-# kill some zombies
-                for i in xrange(len(workers)):
-                    if workers[i] is None:
-                        workers[i].pop
-
+# leases
+                if time.time() > upkeep:
+                    totalwork += keep_leases(db, [config.name], config.lease); bar.total = totalwork
+                    upkeep = time.time() + config.lease / 3
 # fetch DB        
-                cells = [x[0] for x in db.cursor().execute("SELECT cell_id FROM '_queue' WHERE scan_status=0 "
-                            "ORDER BY cell_id LIMIT %d" % ((len(workers)))).fetchall()]
-
-# RPC loop            
-                responses = []
-                delay = float( float(config.delay) / float(len(cells)) )
-                if config.pbar: minibar = tqdm.tqdm(total=len(cells), desc='worker', unit='scan')
-                
-                for i in xrange(len(cells)):
-                    
-                    sleep(delay)
-                    minibar.update()    
-                    
-                    cell = CellId.from_token(cells[i])
-                    lat = CellId.to_lat_lng(cell).lat().degrees 
-                    lng = CellId.to_lat_lng(cell).lng().degrees
-                    cell_ids = get_cell_ids(sub_cells_normalized(cell, level=15))
-                    
-                    log.debug('W%2d doing request for %s (%f, %f)' % (i,cells[i],lat,lng))
-                    
-                    try:
-                        response_dict = get_response(workers[i], cell_ids, lat, lng)
-                    except AccountBannedException:
-                        workers[i] = None
-                        log.error('Worker %d down: Banned' % accounts[i])
-                    except NotLoggedInException:
-                        sleep(config.delay / 2) 
-                        workers[i] = None
-                        workers[i] = api_init(accounts[i])
-                        response_dict = get_response(workers[i], cell_ids, lat, lng)
-                    except: log.error(sys.exc_info()[0]); sleep(config.delay) 
-                    finally:
-                        responses.append(response_dict)
-                
-                minibar.close()
-# end RP loop
-
-# parse loop    
-                querys = []
-                for i in xrange(len(responses)):
-
-                    stats = [0, 0, 0, 0]
-                    response_dict = responses[i]
-                    
-                    if response_dict is None or len(response_dict) == 0:
-                        querys.append("UPDATE _queue SET scan_status=3 WHERE cell_id='{}'".format(cells[i])); done += 1 
-                        continue
-                    
-                    if 'map_cells' in response_dict['responses']['GET_MAP_OBJECTS']:
-                        for map_cell in response_dict['responses']['GET_MAP_OBJECTS']['map_cells']:
-                            cellid = CellId(map_cell['s2_cell_id']).to_token()
-                            stats[0] += 1
-                            content = 0                   
-                            
-                            if 'forts' in map_cell:
-                                for fort in map_cell['forts']:
-                                    if 'gym_points' in fort:
-                                        stats[1]+=1
-                                        content = set_bit(content, 2)
-                                        querys.append("INSERT OR IGNORE INTO forts (fort_id, cell_id, pos_lat, pos_lng, fort_enabled, fort_type, last_scan) "
-                                        "VALUES ('{}','{}',{},{},{},{},{})".format(fort['id'],cellid,fort['latitude'],fort['longitude'], \
-                                        int(fort['enabled']),0,int(map_cell['current_timestamp_ms']/1000)))
-                                    else:
-                                        stats[2]+=1
-                                        content = set_bit(content, 1)
-                                        querys.append("INSERT OR IGNORE INTO forts (fort_id, cell_id, pos_lat, pos_lng, fort_enabled, fort_type, last_scan) "
-                                        "VALUES ('{}','{}',{},{},{},{},{})".format(fort['id'],cellid,fort['latitude'],fort['longitude'], \
-                                        int(fort['enabled']),1,int(map_cell['current_timestamp_ms']/1000)))
-                                                                             
-                            if 'spawn_points' in map_cell:
-                                content = set_bit(content, 0)
-                                for spawn in map_cell['spawn_points']:
-                                    stats[3]+=1;
-                                    spwn_id = CellId.from_lat_lng(LatLng.from_degrees(spawn['latitude'],spawn['longitude'])).parent(20).to_token()
-                                    querys.append("INSERT OR IGNORE INTO spawns (spawn_id, cell_id, pos_lat, pos_lng, last_scan) "
-                                    "VALUES ('{}','{}',{},{},{})".format(spwn_id,cellid,spawn['latitude'],spawn['longitude'],int(map_cell['current_timestamp_ms']/1000)))
-                            if 'decimated_spawn_points' in map_cell:
-                                content = set_bit(content, 0)
-                                for spawn in map_cell['decimated_spawn_points']:
-                                    stats[3]+=1;
-                                    spwn_id = CellId.from_lat_lng(LatLng.from_degrees(spawn['latitude'],spawn['longitude'])).parent(20).to_token()
-                                    querys.append("INSERT OR IGNORE INTO spawns (spawn_id, cell_id, pos_lat, pos_lng, last_scan) "
-                                    "VALUES ('{}','{}',{},{},{})".format(spwn_id,cellid,spawn['latitude'],spawn['longitude'],int(map_cell['current_timestamp_ms']/1000)))
-                                    
-                            querys.append("INSERT OR IGNORE INTO cells (cell_id, content, last_scan) "
-                            "VALUES ('{}', {}, {})".format(cellid,content,int(map_cell['current_timestamp_ms']/1000)))
-                        
-                        log.debug('%s: ' % cells[i] + '%d Cells, %d Gyms, %d Pokestops, %d Spawns.' % tuple(stats))
-                        totalstats[0] += stats[0]; totalstats[1] += stats[1]; totalstats[2] += stats[2]; totalstats[3] += stats[3]
-                        if (stats[1]+stats[2]+stats[3]) > 0: querys.append("UPDATE _queue SET scan_status=1 WHERE cell_id='{}'".format(cells[i]))
-                        else: querys.append("UPDATE _queue SET scan_status=2 WHERE cell_id='{}'".format(cells[i]))
-                        log.debug('Marked %s as Done.' % cells[i])
-                        done += 1
-                    
-                    else: querys.append("UPDATE _queue SET scan_status=3 WHERE cell_id='{}'".format(cells[i])); done += 1
+                idle = len(engine.idle()) if config.route > 0 else 0
+                if idle > 0:
+                    cells = claim_cells(db, config.name, config.route * idle, config.lease)
+                    if donetotal == 0 and inflight == 0: report_routes(cells, idle, config)
+                    engine.route(cells); inflight += len(cells)
+                    if inflight == 0 and not seeding: log.info('Queue drained by other workers.'); break
+                elif config.route == 0 and engine.pending() < len(workers):
+                    cells = claim_cells(db, config.name, 2 * len(workers), config.lease)
+                    engine.put(cells); inflight += len(cells)
+                    if inflight == 0 and not seeding: log.info('Queue drained by other workers.'); break
+
+# parse loop
+                done = 0
+                result = engine.get()
+                while result is not None:
+                    cell, records, stats, answered = result
+                    writer.put(records)
+                    if config.adaptive:
+                        # committed right away, so the next claim already sees them
+                        n = queue_children(db, cell, refine_cell(cell, records, answered)); totalwork += n; bar.total = totalwork
+                    totalstats[0] += stats[0]; totalstats[1] += stats[1]; totalstats[2] += stats[2]; totalstats[3] += stats[3]
+                    done += 1
+                    if done >= len(workers): break
+                    result = engine.get(None)
 # end parse loop                    
-                    
-# save to DB   #f = open('dump.sql','a')
-                try:
-                    dbc = db.cursor()
-                    for query in querys:
-                        dbc.execute(query) #;f.write(query); f.write(';\n')
-
-                except (IntegrityError, ProgrammingError, DataError): 
-                    db.rollback(); log.error('SQL Syntax Error');
-                except (OperationalError, InterfaceError, DatabaseError):
-                    log.critical('Database corrupted or locked'); return
-                except KeyboardInterrupt: db.rollback(); raise KeyboardInterrupt
-                else: db.commit(); log.debug('Inserted %d queries' % len(querys))
+                if done == 0: continue
                  
 # feedback                
-                bar.update(done); donetotal += done
+                bar.update(done); donetotal += done; inflight -= done
+                if seeding:
+                    # the spiral is still growing
+                    seeding = config.seeder.is_alive()
+                    totalwork = donetotal + inflight + pending_cells(db); bar.total = totalwork
                 if not config.pbar: log.info('Queue: %5d done, %5d left' % (donetotal,totalwork-donetotal))
+                log.debug('Rates [req/h]: %s' % ' '.join('%.0f' % r for r in engine.rates()))
 ## end main loop        
 
+            engine.stop()
+            pool.stop()
+            writer.close()
             bar.close()
+            update_spawn_times(db); optimize(db)
+            dedup.report()
             log.info('Total: %d Cells, %d Gyms, %d Pokestops, %d Spawns.' % tuple(totalstats)) 
 
 ##
     except KeyboardInterrupt: log.info('Aborted!')
     else: print("Dekimashita!")
-    finally: db.close()
+    finally:
+        with connect(config.dbfile) as db: release_cells(db, config.name)
+        db.close()
+        if config.dumper: config.dumper.stop()
+
+def run_sharded(config, accounts, minions, totalwork):
+
+    processes = min(config.processes, minions)
+    bar = dummybar()
+    if config.pbar: import tqdm; from fastmap.pbar import TqdmLogHandler; log.addHandler(TqdmLogHandler())
+
+    db = connect(config.dbfile)
+    writer = DBWriter(db)
+    totalstats = [0, 0, 0, 0]
+    donetotal = 0
+
+# one queue shard and one slice of the accounts per process, this process owns the DB
+    shards = shard_queue(db, processes)
+    results = multiprocessing.Queue()
+    procs = [ShardProcess(k, accounts[k::processes], len(xrange(k, minions, processes)),
+                          config.delay, config.mindelay, config.spares, config.authcache, results,
+                          config.dbfile if config.rescan else None, config.speed, config.route > 0,
+                          (config.metrics, config.metricsfile), config.window)
+             for k in xrange(processes)]
+    names = ['%s/%d' % (config.name, k) for k in xrange(processes)]
+    inflight = [0] * processes
+    log.info('Total %5d cells, %3d accounts in %2d processes.' % (totalwork, minions, processes))
+
+    try:
+        for proc in procs: proc.start()
+        if config.pbar: bar = tqdm.tqdm(total=totalwork, desc=' total', unit='scan')
+        alive = set(xrange(processes))
+        upkeep = time.time() + config.lease / 3
+        while len(alive) > 0:
+# leases
+            if time.time() > upkeep:
+                totalwork += keep_leases(db, [names[k] for k in alive], config.lease); bar.total = totalwork
+                upkeep = time.time() + config.lease / 3
+# feed shards
+            for k in alive:
+                if inflight[k] < procs[k].workers and not procs[k].closing:
+                    cells = claim_cells(db, names[k], max(2, config.route) * procs[k].workers, config.lease, shards[k])
+                    procs[k].put(cells); inflight[k] += len(cells)
+                    if inflight[k] == 0: procs[k].close()
+# collect results
+            try: k, cell, records, stats, answered = results.get(True, 1.0)
+            except Empty: writer.flush(); continue
+
+            if cell is None:
+                alive.discard(k); writer.flush(); release_cells(db, names[k])
+                if not procs[k].closing: log.error('Shard %d died, its cells stay queued.' % k)
+                continue
+
+            writer.write(records); inflight[k] -= 1
+            if config.adaptive:
+                n = queue_children(db, cell, refine_cell(cell, records, answered)); totalwork += n; bar.total = totalwork
+            totalstats[0] += stats[0]; totalstats[1] += stats[1]; totalstats[2] += stats[2]; totalstats[3] += stats[3]
+            bar.update(); donetotal += 1
+            if not config.pbar and donetotal % 100 == 0: log.info('Queue: %5d done, %5d left' % (donetotal,totalwork-donetotal))
+
+        bar.close()
+        writer.flush(); update_spawn_times(db); optimize(db)
+        log.info('Total: %d Cells, %d Gyms, %d Pokestops, %d Spawns.' % tuple(totalstats))
+
+    except KeyboardInterrupt: log.info('Aborted!')
+    else: print("Dekimashita!")
+    finally:
+        writer.flush()
+        for name in names: release_cells(db, name)
+        db.close()
+        if config.dumper: config.dumper.stop()
+
+
+def keep_leases(db, names, lease):
+    # renews the leases of this run, takes back the expired ones of crashed peers
+    for name in names: renew_leases(db, name, lease)
+    n = reclaim_cells(db)
+    if n > 0: log.info('Reclaimed %d expired leases.' % n)
+    return n
 
+def report_routes(cells, n, config):
+    (rrkm, rrh), (km, h) = compare_routes(cells, n, config.delay, config.speed)
+    log.info('Walk per account: %.1f km in %.1f h round robin, %.1f km in %.1f h routed.' % (rrkm, rrh, km, h))
 
 class dummybar(object):
     def __init__(self): pass
@@ -4,12 +4,16 @@ import time
 import os
 import sys
 import uuid  # @UnusedImport
+import random
 import platform
 import logging
+import threading
 
 from pgoapi import PGoApi
 from pgoapi.exceptions import AuthException
 
+from fastmap import metrics
+
 log = logging.getLogger(__name__)
 
 
@@ -22,7 +26,23 @@ class PoGoAccount():
         self.username = login
         self.password = passw
 
-def api_init(account):
+def api_init(account, cache=None):
+    # reuses the session of account from cache while it is valid
+    if cache is not None:
+        api = cache.restore(account)
+        if api is not None: return api
+
+    try: api = api_login(account)
+    except AccountBannedException:
+        if cache is not None: cache.invalidate(account)
+        raise
+
+    if cache is not None:
+        if api is None: cache.invalidate(account)
+        else: cache.put(account, api)
+    return api
+
+def api_login(account):
     api = PGoApi()
     
     try:
@@ -57,26 +77,86 @@ def api_init(account):
                 
     return None
 
-def get_response(api, cell_ids, lat, lng, alt=0):
+class AccountThrottle(object):
+    # AIMD request rate of one account: the rate grows by a small step with
+    # every good answer that came back no slower than usual, up to one request
+    # per min_interval (the interval itself unless given), and is halved on a
+    # throttled or empty one, retries back off exponentially with jitter up to max_backoff
+    def __init__(self, interval, min_interval=None, max_interval=300, step=0.005, max_backoff=300):
+        interval = max(interval, 0.01)
+        self.base_interval, self.min_interval = interval, min_interval
+        self.max_rate = 1.0 / max(min_interval or interval, 0.01)
+        self.min_rate = 1.0 / max_interval
+        self.step = step
+        self.max_backoff = max_backoff
+        self.base_backoff = max(interval, 1)
+        self.current = 1.0 / interval
+        self.failures = 0
+        self.latency = 0.0
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # returns the seconds slept
+        with self.lock:
+            delta = self.last + 1.0 / self.current - time.time()
+            if delta > 0: time.sleep(delta)
+            self.last = time.time()
+        return max(0, delta)
+
+    def due(self):
+        # time the next request may go out
+        return self.last + 1.0 / self.current
+
+    def success(self, latency):
+        self.failures = 0
+        # a server answering slower than usual is busy, hold the rate
+        slow = self.latency > 0 and latency > 2 * self.latency
+        self.latency = latency if self.latency == 0 else 0.8 * self.latency + 0.2 * latency
+        if not slow: self.current = min(self.max_rate, self.current + self.step)
+
+    def failure(self):
+        self.failures += 1
+        self.current = max(self.min_rate, self.current / 2)
+
+    def backoff(self):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+        return random.uniform(delay / 2, delay)
+
+    def rate(self):
+        # requests per hour
+        return self.current * 3600
+
+def get_response(api, cell_ids, lat, lng, alt=0, throttle=None, retries=5, timestamps=None):
     
-    timestamps = [0,] * len(cell_ids)
+    if timestamps is None: timestamps = [0,] * len(cell_ids)
     response_dict = []
-    delay = 11
+    if throttle is None: throttle = AccountThrottle(11)
     
-    while True:
+    for dummy in xrange(retries):
         api.set_position(lat, lng, alt)
+        t = time.time()
         response_dict = api.get_map_objects(latitude=lat, longitude=lng, since_timestamp_ms = timestamps, cell_id = cell_ids)
+        metrics.observe('fastmap_rpc_seconds', time.time() - t)
         if response_dict:
             if 'responses' in response_dict:
                 if 'status' in response_dict['responses']['GET_MAP_OBJECTS']:
                     if response_dict['responses']['GET_MAP_OBJECTS']['status'] == 1:
+                        throttle.success(time.time() - t)
+                        metrics.inc('fastmap_rpc_total', result='ok')
                         return response_dict
                     if response_dict['responses']['GET_MAP_OBJECTS']['status'] == 3:
                         log.critical("Account banned!")
+                        metrics.inc('fastmap_rpc_total', result='banned')
                         raise AccountBannedException
 
-        time.sleep(delay)
-        delay += 5
+        metrics.inc('fastmap_rpc_total', result='retry')
+        throttle.failure()
+        time.sleep(throttle.backoff())
+
+    log.warning('No valid response after %d tries.' % retries)
+    metrics.inc('fastmap_rpc_total', result='failed')
+    return None
         
 def check_reponse(response):
   
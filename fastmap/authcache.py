@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import os
+import time
+import pickle
+import logging
+import threading
+
+from contextlib import contextmanager
+
+# no inter-process lock on Windows, shards there should not share a cache file
+try: import fcntl
+except ImportError: fcntl = None
+
+from pgoapi import PGoApi
+from pgoapi.auth_ptc import AuthPtc
+from pgoapi.auth_google import AuthGoogle
+
+from fastmap.apiwrap import get_encryption_lib_path
+
+log = logging.getLogger(__name__)
+
+# session state of the pgoapi auth providers
+AUTH_FIELDS = ('_login', '_access_token', '_access_token_expiry', '_refresh_token',
+               '_ticket_expire', '_ticket_start', '_ticket_end')
+
+
+class AuthCache(object):
+    # auth tickets per account on disk, so restarts skip the login handshake
+    def __init__(self, filename='.authcache', margin=120):
+        self.filename = filename
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _key(self, account):
+        return '%s:%s' % (account.auth_service, account.username)
+
+    def _load(self):
+        if not os.path.isfile(self.filename): return {}
+        try:
+            with open(self.filename, 'rb') as f: return pickle.load(f)
+        except Exception as e: log.warning('Auth cache unreadable, ignored: %r' % e); return {}
+
+    @contextmanager
+    def _locked(self):
+        # threads of this process, then other processes on the same file
+        with self.lock:
+            if fcntl is None: yield; return
+            with open(self.filename + '.lock', 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try: yield
+                finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _update(self, key, entry):
+        # merges into the file as it is on disk, other processes may share it
+        with self._locked():
+            self.entries = self._load()
+            if entry is None:
+                if self.entries.pop(key, None) is None: return
+            else: self.entries[key] = entry
+            tmp = '%s.%d.tmp' % (self.filename, os.getpid())
+            with open(tmp, 'wb') as f:
+                os.chmod(tmp, 0o600)
+                pickle.dump(self.entries, f, 2)
+            if os.path.isfile(self.filename): os.remove(self.filename)
+            os.rename(tmp, self.filename)
+
+    def get(self, account):
+        with self.lock: entry = self.entries.get(self._key(account))
+        if entry is None or entry['expires'] < time.time() + self.margin: return None
+        return entry
+
+    def expires(self, account):
+        entry = self.get(account)
+        return entry['expires'] if entry else 0
+
+    def put(self, account, api):
+        provider = getattr(api, '_auth_provider', None)
+        if provider is None: return
+        auth = dict((k, getattr(provider, k)) for k in AUTH_FIELDS if hasattr(provider, k))
+        expires = auth.get('_access_token_expiry') or 0
+        if auth.get('_ticket_expire'): expires = min(expires, auth['_ticket_expire'] / 1000)
+        self._update(self._key(account), {'auth': auth, 'expires': expires,
+                                          'endpoint': getattr(api, '_api_endpoint', None)})
+
+    def invalidate(self, account):
+        self._update(self._key(account), None)
+
+    def restore(self, account):
+        # a logged in PGoApi from the cached session, or None
+        entry = self.get(account)
+        if entry is None: return None
+        try:
+            api = PGoApi()
+            api.set_position(360,360,0)
+            provider = AuthPtc() if account.auth_service == 'ptc' else AuthGoogle()
+            for k, v in entry['auth'].items(): setattr(provider, k, v)
+            api._auth_provider = provider
+            if entry['endpoint']: api._api_endpoint = entry['endpoint']
+            api.activate_signature(get_encryption_lib_path())
+        except Exception as e:
+            log.warning('Cached session for %s unusable: %r' % (account.username, e))
+            self.invalidate(account); return None
+        log.debug('Reusing cached session for %s' % account.username)
+        return api
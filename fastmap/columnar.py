@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+forts and spawns exported as fixed width .npy columns sorted by S2 cell id,
+read back memory-mapped and sliced by cell without the database, needs numpy
+
+    python -m fastmap.columnar db.sqlite export/
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+
+import numpy as np
+
+from fastmap import s2fast
+
+log = logging.getLogger(__name__)
+
+FORMAT = 1
+INDEX_LEVEL = 10
+# spawn windows are seconds of the hour, unknown ones get NONE
+NONE = 0xffff
+
+# table -> key, [(column, sql, dtype)], position columns are added by export_table
+COLUMNS = {
+    'spawns': ('spawn_id', [('base', 'spawn_time_base', np.uint16), ('offset', 'spawn_time_offset', np.uint16),
+                            ('dur', 'spawn_time_dur', np.uint16), ('static', 'static_spawner', np.uint8)]),
+    'forts': ('fort_id', [('type', 'fort_type', np.uint8), ('enabled', 'fort_enabled', np.uint8)]),
+}
+
+
+def _save(path, name, array):
+    # a reader still mapping the old file keeps it until it lets go
+    tmp = os.path.join(path, '.%s.npy' % name)
+    np.save(tmp, np.ascontiguousarray(array))
+    os.rename(tmp, os.path.join(path, name + '.npy'))
+
+def cell_index(cells, level=INDEX_LEVEL):
+    # (cell, start, stop) of every level cell, the rows of a cell are contiguous
+    parents = s2fast.parent_ids(cells, level)
+    keys, start = np.unique(parents, return_index=True)
+    index = np.empty(len(keys), dtype=[('cell', np.uint64), ('start', np.int64), ('stop', np.int64)])
+    index['cell'], index['start'] = keys, start
+    index['stop'][:-1], index['stop'][-1:] = start[1:], len(cells)
+    return index
+
+def export_table(db, path, table='spawns', precision=np.float64, level=INDEX_LEVEL):
+    # writes path/<table>/ and returns the row count
+    key, extra = COLUMNS[table]
+    path = os.path.join(path, table)
+    if not os.path.isdir(path): os.makedirs(path)
+
+    sql = "SELECT {0}, pos_lat, pos_lng, {1} FROM {2}".format(key, ', '.join(x[1] for x in extra), table)
+    rows = db.execute(sql).fetchall()
+    ids, lat, lng = [x[0] for x in rows], np.array([x[1] for x in rows], np.float64), np.array([x[2] for x in rows], np.float64)
+    cells = s2fast.cell_ids(lat, lng) if len(rows) > 0 else np.empty(0, np.uint64)
+    order = np.argsort(cells, kind='mergesort')
+
+    columns = {'cell': cells[order], 'lat': lat[order].astype(precision), 'lng': lng[order].astype(precision),
+               'id': np.array(ids, dtype='S')[order] if len(rows) > 0 else np.empty(0, 'S1')}
+    for k, (name, dummy, dtype) in enumerate(extra):
+        columns[name] = np.array([NONE if x[3 + k] is None else x[3 + k] for x in rows], dtype)[order]
+    del rows, ids
+    for name, array in columns.iteritems(): _save(path, name, array)
+    _save(path, 'index', cell_index(columns['cell'], level))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'format': FORMAT, 'table': table, 'rows': len(cells), 'level': level, 'exported': int(time.time()),
+                   'columns': dict((name, str(array.dtype)) for name, array in columns.iteritems())}, f)
+    log.info('Exported %d %s.' % (len(cells), table))
+    return len(cells)
+
+def export_columns(db, path, tables=('spawns', 'forts'), precision=np.float64, level=INDEX_LEVEL):
+    return dict((table, export_table(db, path, table, precision, level)) for table in tables)
+
+
+class ColumnStore(object):
+    # one exported table, columns are read-only memory maps loaded on first use
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f: self.meta = json.load(f)
+        if self.meta['format'] != FORMAT: raise ValueError('Unknown export format %r' % self.meta['format'])
+        self.level = self.meta['level']
+        self.columns = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            self.columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self.columns[name]
+
+    def names(self):
+        return sorted(self.meta['columns'])
+
+    def rows(self, cell):
+        # slice of the rows inside cell, a token or id of any level
+        cell = int(cell) if isinstance(cell, (int, long, np.integer)) else int(cell.ljust(16, '0'), 16)
+        lsb = cell & -cell
+        # uint64 scalars throughout, mixing them with python ints goes through float64
+        lo, hi = np.uint64(cell - (lsb - 1)), np.uint64(cell + (lsb - 1))
+        keys = self['index']['cell']
+        if lsb >= 1 << 2 * (30 - self.level):
+            # as coarse as the index or coarser, the index alone has the answer
+            i, j = np.searchsorted(keys, lo), np.searchsorted(keys, hi, side='right')
+            if i >= j: return slice(0, 0)
+            return slice(int(self['index']['start'][i]), int(self['index']['stop'][j - 1]))
+        # finer, binary search within the rows of its index cell
+        parent = s2fast.parent_ids(np.array([cell], np.uint64), self.level)[0]
+        i = np.searchsorted(keys, parent)
+        if i == len(keys) or keys[i] != parent: return slice(0, 0)
+        start, stop = int(self['index']['start'][i]), int(self['index']['stop'][i])
+        cells = self['cell'][start:stop]
+        return slice(start + int(np.searchsorted(cells, lo)), start + int(np.searchsorted(cells, hi, side='right')))
+
+    def select(self, cell, names=None):
+        # {column: view} of the rows inside cell, nothing is copied
+        s = self.rows(cell)
+        return dict((name, self[name][s]) for name in (names or self.names()))
+
+
+def load_columns(path, tables=('spawns', 'forts')):
+    return dict((table, ColumnStore(os.path.join(path, table))) for table in tables
+                if os.path.isfile(os.path.join(path, table, 'meta.json')))
+
+if __name__ == '__main__':
+    from fastmap.db import connect
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)5s] %(asctime)s %(message)s', datefmt="%d.%m.%y %H:%M:%S")
+    if len(sys.argv) < 3: sys.exit('usage: python -m fastmap.columnar DBFILE DIRECTORY')
+    export_columns(connect(sys.argv[1]), sys.argv[2])
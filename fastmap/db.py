@@ -1,7 +1,37 @@
-FMDBVERSION = 2.2
-import sqlite3, os, logging
+FMDBVERSION = 2.8
+import sqlite3, os, time, logging, threading
+from collections import namedtuple
+from itertools import islice
+from Queue import Queue, Empty
+from fastmap import metrics
 log = logging.getLogger(__name__)
 
+# typed scan results, consumed by DBWriter
+Cell = namedtuple('Cell', 'cell_id content last_scan')
+Fort = namedtuple('Fort', 'fort_id cell_id pos_lat pos_lng fort_enabled fort_type last_scan')
+Spawn = namedtuple('Spawn', 'spawn_id cell_id pos_lat pos_lng last_scan')
+QueueStatus = namedtuple('QueueStatus', 'cell_id scan_status content')
+Sighting = namedtuple('Sighting', 'spawn_id last_scan present despawn')
+
+# _changes triggers: table, kind, key, fields whose change is logged
+CHANGES = (('forts', 'fort', 'fort_id', ('pos_lat', 'pos_lng', 'fort_enabled', 'fort_type')),
+           ('spawns', 'spawn', 'spawn_id', ('pos_lat', 'pos_lng', 'spawn_time_base', 'spawn_time_offset',
+                                            'spawn_time_dur', 'static_spawner')))
+# fields of the feed per kind
+FEED = {'fort': ('cell_id', 'pos_lat', 'pos_lng', 'fort_enabled', 'fort_type', 'last_scan'),
+        'spawn': ('cell_id', 'pos_lat', 'pos_lng', 'spawn_time_base', 'spawn_time_offset', 'spawn_time_dur',
+                  'static_spawner', 'last_scan')}
+
+# _queue.scan_status, a refined cell is covered by its finer children and never rescanned
+QUEUE_PENDING, QUEUE_DONE, QUEUE_EMPTY, QUEUE_FAILED, QUEUE_LEASED, QUEUE_REFINED = 0, 1, 2, 3, 4, 5
+# cells that are through, and those a rescan or --due may queue again
+QUEUE_FINISHED = (QUEUE_DONE, QUEUE_EMPTY, QUEUE_REFINED)
+QUEUE_RESCANNABLE = (QUEUE_DONE, QUEUE_EMPTY, QUEUE_FAILED)
+
+def status_sql(*statuses):
+    # scan_status condition with the values inlined, SQLite matches partial indexes only against literals
+    return '(%s)' % ' OR '.join('scan_status=%d' % x for x in statuses)
+
 def check_db(dbfile):
     
     if not os.path.isfile(dbfile):
@@ -20,15 +50,227 @@ def check_db(dbfile):
     
     return True
 
-def fill_db(dbfile, cells):
+def queue_cells(db, cells):
+    # (token, level) pairs as pending queue cells, returns how many were not queued before,
+    # the caller commits
+    before = db.total_changes
+    db.executemany("INSERT OR IGNORE INTO _queue (cell_id,cell_level,scan_status) VALUES (?,?,%d)" % QUEUE_PENDING, cells)
+    return db.total_changes - before
+
+def fill_db(dbfile, cells, chunksize=10000):
+    # cells may be any iterable of CellIds, it is consumed chunk by chunk
+    cells = iter(cells)
+    inserted, total = 0, 0
     with sqlite3.connect(dbfile) as db:
-        counter=0    
-        for cell in cells:
-            db.cursor().execute("INSERT OR IGNORE INTO _queue (cell_id,cell_level,scan_status) "
-                                "VALUES ('{}',{}, 0)".format(cell.to_token(),cell.level()))
-            counter+=1
+        while True:
+            chunk = [(cell.to_token(), cell.level()) for cell in islice(cells, chunksize)]
+            if len(chunk) == 0: break
+            inserted += queue_cells(db, chunk); total += len(chunk)
         db.commit()
-    return counter
+    return inserted, total - inserted
+
+class QueueSeeder(threading.Thread):
+    # fills the queue chunk by chunk in the background, so scanning can
+    # start as soon as the first chunk is committed
+    def __init__(self, dbfile, cells, chunksize=500):
+        threading.Thread.__init__(self, name='QueueSeeder')
+        self.daemon = True
+        self.dbfile = dbfile
+        self.cells = iter(cells)
+        self.chunksize = chunksize
+        self.first = threading.Event()
+        self.inserted, self.present = 0, 0
+
+    def run(self):
+        try:
+            while True:
+                chunk = list(islice(self.cells, self.chunksize))
+                if len(chunk) == 0: break
+                inserted, present = fill_db(self.dbfile, chunk, self.chunksize)
+                self.inserted += inserted; self.present += present
+                self.first.set()
+        finally:
+            self.first.set()
+            log.info('Added %d items to scan queue, %d already present.' % (self.inserted, self.present))
+
+def pending_cells(db):
+    return db.execute("SELECT COUNT(*) FROM _queue WHERE %s" % status_sql(QUEUE_PENDING)).fetchone()[0]
+
+def claim_cells(db, worker, n, lease=600, shard=None):
+    # atomically leases the next n pending cells to worker,
+    # optionally only from the token range shard = (first, last)
+    expires = int(time.time()) + lease
+    where, args = status_sql(QUEUE_PENDING), []
+    if shard is not None:
+        if shard[0] is not None: where += " AND cell_id>=?"; args.append(shard[0])
+        if shard[1] is not None: where += " AND cell_id<?"; args.append(shard[1])
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        cells = [x[0] for x in db.execute("SELECT cell_id FROM _queue WHERE %s "
+                                          "ORDER BY cell_id LIMIT ?" % where, args + [n]).fetchall()]
+        db.executemany("UPDATE _queue SET scan_status=%d, worker=?, lease=? WHERE cell_id=?" % QUEUE_LEASED,
+                       ((worker, expires, cell) for cell in cells))
+    except: db.rollback(); raise
+    else: db.commit()
+    return cells
+
+def shard_queue(db, n):
+    # splits the pending cells into n contiguous token ranges of about equal size
+    total = pending_cells(db)
+    bounds = [None]
+    for k in xrange(1, n):
+        row = db.execute("SELECT cell_id FROM _queue WHERE %s ORDER BY cell_id "
+                         "LIMIT 1 OFFSET ?" % status_sql(QUEUE_PENDING), (k * total / n,)).fetchone()
+        bounds.append(row[0] if row else None)
+    bounds.append(None)
+    return [(bounds[k], bounds[k+1]) for k in xrange(n)]
+
+def release_cells(db, worker):
+    # gives back the leases of exactly this worker, e.g. on shutdown or when its shard died
+    with db: n = db.execute("UPDATE _queue SET scan_status=%d, worker=NULL, lease=NULL "
+                            "WHERE %s AND worker=?" % (QUEUE_PENDING, status_sql(QUEUE_LEASED)), (worker,)).rowcount
+    return n
+
+def renew_leases(db, worker, lease=600):
+    # pushes back the expiry of every cell still leased to worker, routed or in flight
+    with db: n = db.execute("UPDATE _queue SET lease=? WHERE %s AND worker=?" % status_sql(QUEUE_LEASED),
+                            (int(time.time()) + lease, worker)).rowcount
+    return n
+
+def reclaim_cells(db):
+    # returns cells of expired leases to the pending pool
+    with db: n = db.execute("UPDATE _queue SET scan_status=%d, worker=NULL, lease=NULL "
+                            "WHERE %s AND lease<?" % (QUEUE_PENDING, status_sql(QUEUE_LEASED)), (int(time.time()),)).rowcount
+    return n
+
+def rescan_cells(db, max_age, limit, empty_factor=8):
+    # re-queues up to limit cells last scanned more than max_age seconds ago,
+    # spawn cells first, empty cells only after empty_factor times max_age
+    now = int(time.time()); n = 0
+    for what, where, age in (('spawn', status_sql(QUEUE_DONE) + " AND content&1", max_age),
+                             ('other', status_sql(QUEUE_DONE) + " AND NOT content&1", max_age),
+                             ('failed', status_sql(QUEUE_FAILED), max_age),
+                             ('empty', status_sql(QUEUE_EMPTY), max_age * empty_factor)):
+        if n >= limit: break
+        with db:
+            cells = db.execute("SELECT cell_id FROM _queue WHERE %s AND last_scan<? "
+                               "ORDER BY last_scan LIMIT ?" % where, (now - age, limit - n)).fetchall()
+            db.executemany("UPDATE _queue SET scan_status=%d WHERE cell_id=?" % QUEUE_PENDING, cells)
+        if len(cells) > 0: log.info('Re-queued %d stale %s cells.' % (len(cells), what))
+        n += len(cells)
+    return n
+
+class ScanHistory(object):
+    # last scan of map cells in ms for since_timestamp_ms,
+    # called from the scan threads so each gets its own connection
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.local = threading.local()
+
+    def timestamps(self, tokens):
+        db = getattr(self.local, 'db', None)
+        if db is None: db = self.local.db = sqlite3.connect(self.dbfile, timeout=30)
+        known = dict(db.execute("SELECT cell_id, last_scan FROM cells WHERE cell_id IN (%s)"
+                                % ','.join('?' * len(tokens)), tokens).fetchall())
+        return [int(known.get(token) or 0) * 1000 for token in tokens]
+
+def connect(dbfile, timeout=30):
+    db = sqlite3.connect(dbfile, timeout=timeout)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA cache_size=-65536")
+    db.execute("PRAGMA temp_store=MEMORY")
+    return db
+
+class DBWriter(object):
+    # collects records per type and writes them with one executemany each
+    # a rescan only sees what changed, so content bits accumulate and a
+    # cell with known content stays done even if the delta is empty
+    SQL = ((Cell, "INSERT OR IGNORE INTO cells (cell_id, content, last_scan) VALUES (?,?,?)", None),
+           (Cell, "UPDATE cells SET content=content|?, last_scan=? WHERE cell_id=?",
+            lambda x, now: (x.content, x.last_scan, x.cell_id)),
+           (Fort, "INSERT OR IGNORE INTO forts (fort_id, cell_id, pos_lat, pos_lng, fort_enabled, fort_type, last_scan) "
+                  "VALUES (?,?,?,?,?,?,?)", None),
+           # known ones are updated, the _changes triggers only log real changes
+           (Fort, "UPDATE forts SET fort_enabled=?, fort_type=?, last_scan=MAX(last_scan,?) WHERE fort_id=?",
+            lambda x, now: (x.fort_enabled, x.fort_type, x.last_scan, x.fort_id)),
+           (Spawn, "INSERT OR IGNORE INTO spawns (spawn_id, cell_id, pos_lat, pos_lng, last_scan) VALUES (?,?,?,?,?)", None),
+           (Spawn, "UPDATE spawns SET last_scan=MAX(last_scan,?) WHERE spawn_id=?", lambda x, now: (x.last_scan, x.spawn_id)),
+           (Sighting, "INSERT OR IGNORE INTO _spawnlog (spawn_id) VALUES (?)", lambda x, now: (x.spawn_id,)),
+           # one bit per minute of the hour, hits counts the hours a spawn was seen in
+           (Sighting, "UPDATE _spawnlog SET seen=seen|?, absent=absent|?, despawn=COALESCE(?,despawn), "
+                      "hits=hits+(CASE WHEN ?>=last/3600*3600+3600 THEN 1 ELSE 0 END), last=MAX(last,?), dirty=1 "
+                      "WHERE spawn_id=?",
+            lambda x, now: ((1 << x.last_scan % 3600 / 60) if x.present else 0, 0 if x.present else (1 << x.last_scan % 3600 / 60),
+                            x.despawn, x.last_scan if x.present else 0, x.last_scan if x.present else 0, x.spawn_id)),
+           (QueueStatus, "UPDATE _queue SET scan_status=CASE WHEN scan_status={0} THEN {0} WHEN ?={1} AND content>0 THEN {2} ELSE ? END, "
+                         "content=COALESCE(content,0)|?, last_scan=?, worker=NULL, lease=NULL WHERE cell_id=?"
+                         .format(QUEUE_REFINED, QUEUE_EMPTY, QUEUE_DONE),
+            lambda x, now: (x.scan_status, x.scan_status, x.content, now, x.cell_id)))
+
+    def __init__(self, db, batchsize=5000):
+        self.db = db
+        self.batchsize = batchsize
+        self.batch = dict((kind, []) for kind, dummy, dummy in self.SQL)
+        self.size = 0
+
+    def write(self, records):
+        for record in records:
+            self.batch[type(record)].append(record)
+        self.size += len(records)
+        if self.size >= self.batchsize: return self.flush()
+        return 0
+
+    def flush(self):
+        if self.size == 0: return 0
+        try:
+            dbc = self.db.cursor()
+            t = time.time(); now = int(t)
+            for kind, sql, params in self.SQL:
+                if params is None: dbc.executemany(sql, self.batch[kind])
+                else: dbc.executemany(sql, (params(x, now) for x in self.batch[kind]))
+        except (sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.DataError) as e:
+            self.db.rollback(); log.error('SQL Error: %s' % e)
+        except KeyboardInterrupt: self.db.rollback(); raise KeyboardInterrupt
+        else:
+            self.db.commit(); log.debug('Inserted %d records' % self.size)
+            metrics.observe('fastmap_db_flush_seconds', time.time() - t)
+            for kind in self.batch: metrics.inc('fastmap_db_records_total', len(self.batch[kind]), kind=kind.__name__)
+        finally:
+            written = self.size; self.size = 0
+            for kind in self.batch: del self.batch[kind][:]
+        return written
+
+class DBWriterThread(threading.Thread):
+    # owns its own connection, fed through put() so parsing never waits on disk
+    def __init__(self, dbfile, batchsize=5000, interval=1.0):
+        threading.Thread.__init__(self, name='DBWriter')
+        self.daemon = True
+        self.dbfile = dbfile
+        self.batchsize = batchsize
+        self.interval = interval
+        self.records = Queue()
+        self.written = 0
+
+    def put(self, records):
+        self.records.put(records)
+
+    def close(self):
+        self.records.put(None); self.join()
+
+    def run(self):
+        db = connect(self.dbfile)
+        writer = DBWriter(db, self.batchsize)
+        try:
+            while True:
+                try: records = self.records.get(True, self.interval)
+                except Empty: self.written += writer.flush(); continue
+                if records is None: break
+                self.written += writer.write(records)
+        except (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.DatabaseError):
+            log.critical('Database corrupted or locked')
+        finally:
+            self.written += writer.flush(); db.close()
 
 def convert_db(dbfile, olddbv):
     with sqlite3.connect(dbfile) as db: 
@@ -40,11 +282,58 @@ def convert_db(dbfile, olddbv):
                 db.cursor().execute("DROP TABLE _config")
                 db.execute("CREATE TABLE _config (version DECIMAL DEFAULT 1.0)")              
                 db.cursor().execute("ALTER TABLE _queue ADD scan_status INT")
-                db.cursor().execute("UPDATE _queue SET scan_status = 0 WHERE scan_status IS NULL")
+                db.cursor().execute("UPDATE _queue SET scan_status = %d WHERE scan_status IS NULL" % QUEUE_PENDING)
                 db.execute("INSERT INTO _config (version) VALUES (2.2)")
                 newdbv = 2.2
-            
-            db.cursor().execute("VACUUM")
+
+            if newdbv == 2.2 or newdbv == '2.2':
+                log.info('Converting DB from 2.2 to 2.3...')
+
+                db.cursor().execute("ALTER TABLE _queue ADD worker VARCHAR")
+                db.cursor().execute("ALTER TABLE _queue ADD lease TIMESTAMP")
+                create_queue_index(db)
+                db.cursor().execute("UPDATE _config SET version = 2.3")
+                newdbv = 2.3
+
+            if newdbv == 2.3 or newdbv == '2.3':
+                log.info('Converting DB from 2.3 to 2.4...')
+
+                db.cursor().execute("ALTER TABLE _queue ADD content INT")
+                db.cursor().execute("ALTER TABLE _queue ADD last_scan TIMESTAMP")
+                # content of old scans is unknown, treat them as spawn cells due for a rescan
+                db.cursor().execute("UPDATE _queue SET content=1, last_scan=0 WHERE %s" % status_sql(QUEUE_DONE))
+                db.cursor().execute("UPDATE _queue SET content=0, last_scan=0 WHERE %s" % status_sql(QUEUE_EMPTY, QUEUE_FAILED))
+                create_scan_index(db)
+                db.cursor().execute("UPDATE _config SET version = 2.4")
+                newdbv = 2.4
+
+            if newdbv == 2.4 or newdbv == '2.4':
+                log.info('Converting DB from 2.4 to 2.5...')
+
+                create_spatial_index(db)
+                db.cursor().execute("UPDATE _config SET version = 2.5")
+                newdbv = 2.5
+
+            if newdbv == 2.5 or newdbv == '2.5':
+                log.info('Converting DB from 2.5 to 2.6...')
+
+                create_spawnlog(db)
+                db.cursor().execute("UPDATE _config SET version = 2.6")
+                newdbv = 2.6
+
+            if newdbv == 2.6 or newdbv == '2.6':
+                log.info('Converting DB from 2.6 to 2.7...')
+
+                create_changelog(db, backfill=True)
+                db.cursor().execute("UPDATE _config SET version = 2.7")
+                newdbv = 2.7
+
+            if newdbv == 2.7 or newdbv == '2.7':
+                log.info('Converting DB from 2.7 to 2.8...')
+
+                create_scan_index(db)
+                db.cursor().execute("UPDATE _config SET version = 2.8")
+                newdbv = 2.8
         except Exception as e: log.error(e); db.rollback()
         else: db.commit()
         finally:
@@ -53,11 +342,98 @@ def convert_db(dbfile, olddbv):
             else:
                 log.error('DB could not be converted!'); return olddbv
 
+def create_queue_index(db):
+    # partial indexes keep claiming and reclaiming independent of the done fraction
+    db.execute("CREATE INDEX IF NOT EXISTS _queue_pending ON _queue (cell_id) WHERE %s" % status_sql(QUEUE_PENDING))
+    db.execute("CREATE INDEX IF NOT EXISTS _queue_leased ON _queue (lease) WHERE %s" % status_sql(QUEUE_LEASED))
+
+def create_scan_index(db):
+    # picks the stalest cells per status for rescans; partial, so claiming and counting
+    # pending cells stay on _queue_pending, and spelled out with OR by status_sql, which
+    # is what lets SQLite match it against a single status
+    db.execute("DROP INDEX IF EXISTS _queue_scanned")
+    db.execute("CREATE INDEX IF NOT EXISTS _queue_rescan ON _queue (scan_status, last_scan) "
+               "WHERE %s" % status_sql(*QUEUE_RESCANNABLE))
+
+def create_spatial_index(db):
+    # R*Trees over forts and spawns, filled from what is already there and
+    # kept in sync by triggers, used by fastmap.query; the R*Tree insert is most
+    # of what a new row costs the DBWriter, see benchmarks/bench_writer.py
+    for table, key in (('forts', 'fort_id'), ('spawns', 'spawn_id')):
+        exists = db.execute("SELECT 1 FROM sqlite_master WHERE name=?", (table + '_rtree',)).fetchone()
+        if exists: continue
+        db.execute("CREATE VIRTUAL TABLE {0}_rtree USING rtree(id, lat_min, lat_max, lng_min, lng_max, +{1})".format(table, key))
+        db.execute("INSERT INTO {0}_rtree (lat_min, lat_max, lng_min, lng_max, {1}) "
+                   "SELECT pos_lat, pos_lat, pos_lng, pos_lng, {1} FROM {0}".format(table, key))
+        db.execute("CREATE TRIGGER {0}_rtree_insert AFTER INSERT ON {0} BEGIN "
+                   "INSERT INTO {0}_rtree (lat_min, lat_max, lng_min, lng_max, {1}) "
+                   "VALUES (NEW.pos_lat, NEW.pos_lat, NEW.pos_lng, NEW.pos_lng, NEW.{1}); END".format(table, key))
+        # the point lookup finds the entry without scanning the whole tree
+        db.execute("CREATE TRIGGER {0}_rtree_delete AFTER DELETE ON {0} BEGIN "
+                   "DELETE FROM {0}_rtree WHERE id IN (SELECT id FROM {0}_rtree WHERE "
+                   "lat_min<=OLD.pos_lat AND lat_max>=OLD.pos_lat AND lng_min<=OLD.pos_lng AND lng_max>=OLD.pos_lng "
+                   "AND {1}=OLD.{1}); END".format(table, key))
+        db.execute("CREATE TRIGGER {0}_rtree_update AFTER UPDATE OF pos_lat, pos_lng ON {0} BEGIN "
+                   "DELETE FROM {0}_rtree WHERE id IN (SELECT id FROM {0}_rtree WHERE "
+                   "lat_min<=OLD.pos_lat AND lat_max>=OLD.pos_lat AND lng_min<=OLD.pos_lng AND lng_max>=OLD.pos_lng "
+                   "AND {1}=OLD.{1}); "
+                   "INSERT INTO {0}_rtree (lat_min, lat_max, lng_min, lng_max, {1}) "
+                   "VALUES (NEW.pos_lat, NEW.pos_lat, NEW.pos_lng, NEW.pos_lng, NEW.{1}); END".format(table, key))
+
+def create_spawnlog(db):
+    # sightings folded into minute of the hour masks, read by fastmap.spawntimes
+    db.execute("CREATE TABLE IF NOT EXISTS _spawnlog (spawn_id VARCHAR PRIMARY KEY, seen INT DEFAULT 0, "
+               "absent INT DEFAULT 0, despawn INT, hits INT DEFAULT 0, last TIMESTAMP DEFAULT 0, "
+               "dirty INT DEFAULT 0) WITHOUT ROWID")
+    db.execute("CREATE INDEX IF NOT EXISTS _spawnlog_dirty ON _spawnlog (spawn_id) WHERE dirty=1")
+    db.execute("CREATE INDEX IF NOT EXISTS spawns_time ON spawns (spawn_time_base) WHERE spawn_time_base IS NOT NULL")
+
+def create_changelog(db, backfill=False):
+    # every insert, real update and delete of forts and spawns gets the next seq,
+    # AUTOINCREMENT never reuses one even after pruning, read by changes_since;
+    # backfill logs the rows already there as inserts, so a feed from seq 0 has them all
+    db.execute("CREATE TABLE IF NOT EXISTS _changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, kind VARCHAR, "
+               "op VARCHAR, key VARCHAR, time TIMESTAMP)")
+    db.execute("CREATE INDEX IF NOT EXISTS _changes_time ON _changes (time)")
+    for table, kind, key, fields in CHANGES:
+        changed = ' OR '.join('OLD.{0} IS NOT NEW.{0}'.format(field) for field in fields)
+        for op, when, ref in (('insert', 'INSERT', 'NEW'), ('update', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD')):
+            db.execute("CREATE TRIGGER IF NOT EXISTS {0}_changes_{1} AFTER {2} ON {0} {3}BEGIN "
+                       "INSERT INTO _changes (kind, op, key, time) VALUES ('{4}', '{1}', {5}.{6}, strftime('%s','now')); END"
+                       .format(table, op, when, 'WHEN %s ' % changed if op == 'update' else '', kind, ref, key))
+    if backfill:
+        for table, kind, key, fields in CHANGES:
+            db.execute("INSERT INTO _changes (kind, op, key, time) SELECT '{0}', 'insert', {1}, strftime('%s','now') "
+                       "FROM {2} ORDER BY {1}".format(kind, key, table))
+
+def changes_since(db, cursor=0, chunksize=1000):
+    # dicts of the changes after seq cursor, oldest first, with the current row
+    # of the fort or spawn, None fields once it is deleted
+    columns = ', '.join('%s.%s' % (table[0], field) for table, kind, key, fields in CHANGES for field in FEED[kind])
+    sql = ("SELECT c.seq, c.kind, c.op, c.key, c.time, {0} FROM _changes c "
+           "LEFT JOIN forts f ON c.kind='fort' AND f.fort_id=c.key "
+           "LEFT JOIN spawns s ON c.kind='spawn' AND s.spawn_id=c.key "
+           "WHERE c.seq>? ORDER BY c.seq LIMIT ?").format(columns)
+    offsets = {'fort': 5, 'spawn': 5 + len(FEED['fort'])}
+    while True:
+        rows = db.execute(sql, (cursor, chunksize)).fetchall()
+        for row in rows:
+            change = dict(zip(('seq', 'kind', 'op', 'id', 'time'), row[:5]))
+            offset = offsets[change['kind']]
+            change.update(zip(FEED[change['kind']], row[offset:offset + len(FEED[change['kind']])]))
+            yield change
+        if len(rows) < chunksize: return
+        cursor = rows[-1][0]
+
 def create_db(dbfile):
     try:
         db = sqlite3.connect(dbfile); dbc = db.cursor()
+        # freed pages go back in small steps, see fastmap.maintenance
+        dbc.execute("PRAGMA auto_vacuum=INCREMENTAL")
         dbc.execute("CREATE TABLE _config (version DECIMAL DEFAULT 1.0)")
-        dbc.execute("CREATE TABLE _queue (cell_id VARCHAR PRIMARY KEY, cell_level INT, scan_status INT) WITHOUT ROWID")
+        dbc.execute("CREATE TABLE _queue (cell_id VARCHAR PRIMARY KEY, cell_level INT, scan_status INT, "
+                    "worker VARCHAR, lease TIMESTAMP, content INT, last_scan TIMESTAMP) WITHOUT ROWID")
+        create_queue_index(db); create_scan_index(db)
         dbc.execute("CREATE TABLE cells (cell_id VARCHAR PRIMARY KEY, content INT, last_scan TIMESTAMP) WITHOUT ROWID")
         dbc.execute("CREATE TABLE forts (fort_id VARCHAR PRIMARY KEY, cell_id VARCHAR, \
         pos_lat DOUBLE, pos_lng DOUBLE, fort_enabled BOOLEAN, fort_type INT, fort_description TEXT, \
@@ -67,6 +443,7 @@ def create_db(dbfile):
         pos_lat DOUBLE, pos_lng DOUBLE, static_spawner INT DEFAULT (0), nest_spawner INT DEFAULT (0), \
         spawn_time_base TIME, spawn_time_offset TIME, spawn_time_dur TIME, last_scan TIMESTAMP, \
         FOREIGN KEY (cell_id) REFERENCES cells (cell_id) ) WITHOUT ROWID")
+        create_spatial_index(db); create_spawnlog(db); create_changelog(db)
         dbc.execute("INSERT INTO _config (version) VALUES (%s)" % FMDBVERSION)
         log.info('DB created!')
     except Exception as e: log.error(e); db.rollback(); return False
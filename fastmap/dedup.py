@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+bounded memory of the map cells, forts and spawn points recorded lately,
+overlapping responses skip what is already in the database unchanged
+"""
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# rough size of one entry: key tuple, value tuple and its dict slot
+ENTRY_BYTES = 320
+
+# the parser's cache, None when deduplication is off
+CACHE = None
+
+
+class SeenCache(object):
+    # key -> (timestamp, state) in two generations of plain dicts: when the young
+    # one is full the old one is dropped, entries used since move up, which is
+    # close to LRU at a fraction of the cost of an OrderedDict; an entry only
+    # counts while it is younger than refresh seconds, so last_scan in the
+    # database is at most that old
+    def __init__(self, budget=32, refresh=1800):
+        self.maxsize = max(1024, int(budget * 1024 * 1024 / ENTRY_BYTES))
+        self.refresh = refresh
+        self.young, self.old = {}, {}
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def _find(self, key):
+        entry = self.young.get(key)
+        if entry is None:
+            entry = self.old.pop(key, None)
+            if entry is not None: self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        if len(self.young) >= self.maxsize / 2: self.old, self.young = self.young, {}
+        self.young[key] = entry
+
+    def get(self, key, timestamp):
+        # state recorded for key within refresh seconds before timestamp, or None
+        with self.lock:
+            entry = self._find(key)
+            if entry is None or not 0 <= timestamp - entry[0] < self.refresh:
+                self.misses += 1; return None
+            self.hits += 1
+        return entry[1]
+
+    def put(self, key, timestamp, state=True):
+        with self.lock: self._store(key, (timestamp, state))
+
+    def seen(self, key, timestamp, state=True):
+        # True if key was recorded with this very state lately, otherwise it is now
+        with self.lock:
+            entry = self._find(key)
+            if entry is not None and entry[1] == state and 0 <= timestamp - entry[0] < self.refresh:
+                self.hits += 1; return True
+            self._store(key, (timestamp, state)); self.misses += 1
+        return False
+
+    def rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self.young) + len(self.old)
+
+
+def configure(budget=32, refresh=1800):
+    # budget in MB, 0 turns deduplication off
+    global CACHE
+    CACHE = SeenCache(budget, refresh) if budget > 0 else None
+    return CACHE
+
+def report():
+    if CACHE is None: return
+    log.info('Dedup: %.1f%% of %d objects skipped, %d of %d entries used.' % (
+             100 * CACHE.rate(), CACHE.hits + CACHE.misses, len(CACHE), CACHE.maxsize))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import heapq
+import logging
+import threading
+
+from Queue import Queue, Empty
+
+from pgoapi.exceptions import NotLoggedInException
+
+from fastmap import metrics
+from fastmap.apiwrap import api_init, get_response, AccountThrottle, AccountBannedException
+from fastmap.db import QueueStatus, QUEUE_FAILED
+from fastmap.parser import parse_response
+from fastmap.route import plan_routes
+from fastmap.utils import cell_geometry, distance, id_tokens
+
+log = logging.getLogger(__name__)
+
+
+class ScanWorker(threading.Thread):
+    # one logged in account, walking its own route first and then
+    # pulling cells from the shared task queue
+    def __init__(self, wid, api, account, tasks, results, delay, min_delay=None, pool=None, since=None, speed=None):
+        threading.Thread.__init__(self, name='W%02d' % wid)
+        self.daemon = True
+        self.wid = wid
+        self.api = api
+        self.account = account
+        self.tasks = tasks
+        self.results = results
+        self.throttle = AccountThrottle(delay, min_delay)
+        self.pool = pool
+        self.since = since
+        self.speed = speed
+        self.route = Queue()
+        self.position, self.last = None, 0
+        self.banned = True
+        self.scans = 0
+
+    def next(self):
+        while True:
+            try: return self.route.get_nowait()
+            except Empty: pass
+            try: return self.tasks.get(True, 0.5)
+            except Empty: continue
+
+    def take(self):
+        # the next cell without waiting, None when there is none
+        try: return self.route.get_nowait()
+        except Empty: pass
+        try: return self.tasks.get_nowait()
+        except Empty: return None
+
+    def walk(self, cell):
+        # no faster than speed from the last scan position, returns the seconds waited
+        lat, lng = cell_geometry(cell)[:2]
+        wait = 0
+        if self.speed and self.position is not None:
+            wait = distance(self.position[0], self.position[1], lat, lng) / self.speed - (time.time() - self.last)
+            if wait > 0: time.sleep(wait)
+        self.position = (lat, lng)
+        return max(0, wait)
+
+    def run(self):
+        while self.api is not None:
+            cell = self.next()
+            if cell is None or not self.process(cell): break
+
+    def process(self, cell):
+        # scans and parses one cell, False once this worker is down
+        if self.pool is not None:
+            api = self.pool.refreshed(self.account)
+            if api is not None: self.api = api
+        metrics.gauge('fastmap_route_depth', self.route.qsize(), worker=self.name)
+        metrics.gauge('fastmap_queue_depth', self.tasks.qsize())
+        metrics.inc('fastmap_wait_seconds_total', self.walk(cell), worker=self.name, reason='walk')
+        metrics.inc('fastmap_wait_seconds_total', self.throttle.wait(), worker=self.name, reason='throttle')
+        t = time.time()
+        response_dict = self.scan(cell)
+        self.last = time.time()
+        metrics.observe('fastmap_scan_seconds', self.last - t, worker=self.name)
+        metrics.gauge('fastmap_request_rate', self.throttle.rate(), worker=self.name)
+        if self.api is None:
+            # hand the cell over to the remaining workers
+            self.tasks.put(cell)
+            if self.swap(): return True
+            self.handover()
+            return False
+        self.scans += 1
+        metrics.inc('fastmap_scans_total', worker=self.name)
+        # only the compact records are kept, the raw response is dropped here
+        t = time.time()
+        try: records, stats, answered = parse_response(cell, response_dict)
+        except Exception as e:
+            log.error('Unparsable response for %s: %r' % (cell, e))
+            records, stats, answered = [QueueStatus(cell, QUEUE_FAILED, 0)], [0, 0, 0, 0], {}
+        metrics.observe('fastmap_parse_seconds', time.time() - t)
+        del response_dict
+        self.results.put((cell, records, stats, answered))
+        return True
+
+    def scan(self, token):
+        lat, lng, cell_ids = cell_geometry(token)
+        # with a scan history only changes since the last scan are requested
+        timestamps = self.since(id_tokens(cell_ids)) if self.since is not None else None
+
+        log.debug('W%2d doing request for %s (%f, %f)' % (self.wid, token, lat, lng))
+
+        try:
+            return get_response(self.api, cell_ids, lat, lng, throttle=self.throttle, timestamps=timestamps)
+        except AccountBannedException:
+            log.error('Worker %d down: Banned' % self.wid); self.api = None; self.banned = True
+            metrics.inc('fastmap_bans_total', worker=self.name)
+        except NotLoggedInException:
+            if self.pool is not None:
+                # a spare takes over while the pool logs this account in again
+                self.api = None; self.banned = False; return None
+            self.throttle.wait()
+            self.api = api_init(self.account)
+            if self.api is None: log.error('Worker %d down: Login failed' % self.wid)
+            else:
+                try: return get_response(self.api, cell_ids, lat, lng, throttle=self.throttle, timestamps=timestamps)
+                except AccountBannedException: self.api = None
+        except: log.error(sys.exc_info()[0])
+        return None
+
+    def handover(self):
+        # the rest of the route goes to the shared queue
+        while True:
+            try: cell = self.route.get_nowait()
+            except Empty: break
+            if cell is not None: self.tasks.put(cell)
+
+    def swap(self):
+        # continue with a spare account from the pool
+        if self.pool is None: return False
+        spare = self.pool.replace(self.account, self.banned)
+        if spare is None: log.error('Worker %d down: No spare left' % self.wid); return False
+        self.api, self.account = spare
+        self.throttle = AccountThrottle(self.throttle.base_interval, self.throttle.min_interval)
+        self.position = None
+        return True
+
+
+class ScanEngine(object):
+    # runs one ScanWorker per api, results arrive as (cell_token, records, stats, answered)
+    def __init__(self, apis, accounts, delay, min_delay=None, pool=None, since=None, speed=None):
+        self.tasks = Queue()
+        self.results = Queue()
+        self.workers = [ScanWorker(i, apis[i], accounts[i], self.tasks, self.results, delay, min_delay, pool, since, speed)
+                        for i in xrange(len(apis))]
+
+    def start(self):
+        for worker in self.workers: worker.start()
+
+    def stop(self, timeout=5.0):
+        for worker in self.workers: worker.route.put(None); self.tasks.put(None)
+        for worker in self.workers: worker.join(timeout)
+
+    def put(self, cells):
+        for cell in cells: self.tasks.put(cell)
+
+    def route(self, cells):
+        # splits cells into one walk per worker that has run out of route
+        workers = self.idle() or [w for w in self.workers if self.up(w)]
+        if len(workers) == 0: return self.put(cells)
+        for worker, route in zip(workers, plan_routes(cells, [w.position for w in workers])):
+            for cell in route: worker.route.put(cell)
+            if not self.up(worker): worker.handover()
+
+    def up(self, worker):
+        return worker.is_alive()
+
+    def idle(self):
+        # live workers at the end of their route
+        return [w for w in self.workers if self.up(w) and w.route.qsize() == 0]
+
+    def pending(self):
+        return self.tasks.qsize() + sum(w.route.qsize() for w in self.workers if self.up(w))
+
+    def rates(self):
+        # current requests per hour of every live account
+        return [w.throttle.rate() for w in self.workers if self.up(w)]
+
+    def alive(self):
+        return len([w for w in self.workers if self.up(w)])
+
+    def get(self, timeout=1.0):
+        # timeout None polls without blocking
+        try: return self.results.get(timeout is not None, timeout)
+        except Empty: return None
+
+
+class WindowEngine(ScanEngine):
+    # many accounts without a thread each: a window of threads always takes
+    # the account whose throttle is due first, so at most window requests
+    # are in flight however many accounts there are
+    def __init__(self, window, apis, accounts, delay, min_delay=None, pool=None, since=None, speed=None):
+        ScanEngine.__init__(self, apis, accounts, delay, min_delay, pool, since, speed)
+        self.window = window
+        self.lock = threading.Lock()
+        self.due = [(0, w.wid) for w in self.workers]
+        self.threads = []
+        self.busy = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._run, name='Window%02d' % i)
+                        for i in xrange(min(self.window, len(self.workers)))]
+        for t in self.threads: t.daemon = True; t.start()
+
+    def stop(self, timeout=5.0):
+        self.running = False
+        for t in self.threads: t.join(timeout)
+
+    def up(self, worker):
+        # a worker is down for good once process() returned False
+        return worker.api is not None
+
+    def _run(self):
+        while self.running:
+            with self.lock: due, wid = heapq.heappop(self.due) if self.due else (None, None)
+            if wid is None: time.sleep(0.1); continue
+            worker = self.workers[wid]
+            cell = worker.take()
+            if cell is None:
+                # nothing to do, the account is looked at again in a moment
+                with self.lock: heapq.heappush(self.due, (time.time() + 0.5, wid))
+                if due > time.time(): time.sleep(0.05)
+                continue
+            with self.lock: self.busy += 1; metrics.gauge('fastmap_window_busy', self.busy)
+            alive = worker.process(cell)
+            with self.lock:
+                self.busy -= 1
+                if alive: heapq.heappush(self.due, (worker.throttle.due(), wid))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+online upkeep of the database: retention pruning, incremental vacuum and
+planner statistics in small steps that leave a running scan undisturbed
+"""
+
+import time
+import logging
+
+from fastmap.db import QUEUE_FINISHED, status_sql
+
+log = logging.getLogger(__name__)
+
+# (table, key, rows that age out before cutoff ?), in this order: a delta rescan leaves
+# out unchanged forts and spawns, so they only age out once their map cell went
+# unscanned as well; a spawn log goes with its spawn, absences alone never set its last
+STALE = (('forts', 'fort_id', "SELECT f.fort_id FROM forts f LEFT JOIN cells c ON c.cell_id=f.cell_id "
+                              "WHERE MAX(f.last_scan, COALESCE(c.last_scan,0))<?"),
+         ('spawns', 'spawn_id', "SELECT s.spawn_id FROM spawns s LEFT JOIN cells c ON c.cell_id=s.cell_id "
+                                "WHERE MAX(s.last_scan, COALESCE(c.last_scan,0))<?"),
+         ('_spawnlog', 'spawn_id', "SELECT spawn_id FROM _spawnlog l WHERE dirty=0 AND last<? "
+                                   "AND NOT EXISTS (SELECT 1 FROM spawns s WHERE s.spawn_id=l.spawn_id)"),
+         ('_changes', 'seq', "SELECT seq FROM _changes WHERE time<?"))
+
+
+def _batched(db, sql, params, batch, pause):
+    # deletes batch rows per transaction, so the writer waits milliseconds at most
+    n = 0
+    while True:
+        with db: k = db.execute(sql, params + (batch,)).rowcount
+        n += k
+        if k < batch: return n
+        time.sleep(pause)
+
+def prune_queue(db, max_age, batch=1000, pause=0.05, now=None):
+    # finished _queue rows last scanned over max_age seconds ago, they drop out of rescans too
+    cutoff = int(now if now is not None else time.time()) - max_age
+    n = _batched(db, "DELETE FROM _queue WHERE cell_id IN (SELECT cell_id FROM _queue "
+                 "WHERE %s AND last_scan<? LIMIT ?)" % status_sql(*QUEUE_FINISHED), (cutoff,), batch, pause)
+    if n > 0: log.info('Pruned %d finished queue rows.' % n)
+    return n
+
+def prune_stale(db, max_age, batch=1000, pause=0.05, now=None):
+    # forts, spawns and spawn logs not seen in a scan for max_age seconds are gone from the map,
+    # changes older than that are of no use to a feed reader either
+    cutoff = int(now if now is not None else time.time()) - max_age
+    n = 0
+    for table, key, select in STALE:
+        k = _batched(db, "DELETE FROM {0} WHERE {1} IN ({2} LIMIT ?)".format(table, key, select), (cutoff,), batch, pause)
+        if k > 0: log.info('Pruned %d stale rows from %s.' % (k, table))
+        n += k
+    return n
+
+def auto_vacuum(db):
+    # 0 none, 1 full, 2 incremental
+    return db.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def enable_incremental(db):
+    # switching an existing file over needs one last full, blocking VACUUM
+    if auto_vacuum(db) == 2: return False
+    db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    db.execute("VACUUM")
+    return True
+
+def incremental_vacuum(db, pages=256, pause=0.05, limit=None):
+    # hands free pages back to the file system a few at a time, returns the pages freed
+    if auto_vacuum(db) != 2:
+        log.warning('auto_vacuum is not incremental, run vacuum.py --full once.'); return 0
+    n = 0
+    while limit is None or n < limit:
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if free == 0: break
+        step = min(pages, free) if limit is None else min(pages, free, limit - n)
+        db.execute("PRAGMA incremental_vacuum(%d)" % step).fetchall()
+        n += step
+        time.sleep(pause)
+    # a passive checkpoint never waits for readers or the writer
+    db.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    if n > 0: log.info('Freed %d pages.' % n)
+    return n
+
+def optimize(db, full=False):
+    # full runs ANALYZE over everything, otherwise SQLite only analyzes what needs it
+    db.execute("ANALYZE" if full else "PRAGMA optimize").fetchall()
+
+def maintain(db, queue_age=None, stale_age=None, pages=256, pause=0.05, analyze=False):
+    # one pass of everything, safe to run alongside bootstrap.py, an age of None skips that pruning
+    if queue_age is not None: prune_queue(db, queue_age, pause=pause)
+    if stale_age is not None: prune_stale(db, stale_age, pause=pause)
+    freed = incremental_vacuum(db, pages, pause)
+    optimize(db, analyze)
+    return freed
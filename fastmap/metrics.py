@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+in-process counters, gauges and latency histograms, served as Prometheus
+text on a local port and dumped to a JSON file now and then
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.gauges = {}
+        self.histograms = {}    # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None: h = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for k, bound in enumerate(self.buckets):
+                if value <= bound: h[k] += 1
+            h[-2] += value; h[-1] += 1
+
+    def prometheus(self):
+        def fmt(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels: return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels)
+        lines = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(n for n, dummy in values)):
+                    lines.append('# TYPE %s %s' % (name, kind))
+                    lines.extend('%s%s %s' % (name, fmt(l), repr(float(v))) for (n, l), v in sorted(values.items()) if n == name)
+            for name in sorted(set(n for n, dummy in self.histograms)):
+                lines.append('# TYPE %s histogram' % name)
+                for (n, l), h in sorted(self.histograms.items()):
+                    if n != name: continue
+                    for bound, count in zip(self.buckets, h):
+                        lines.append('%s_bucket%s %d' % (name, fmt(l, (('le', bound),)), count))
+                    lines.append('%s_bucket%s %d' % (name, fmt(l, (('le', '+Inf'),)), h[-1]))
+                    lines.append('%s_sum%s %s' % (name, fmt(l), repr(float(h[-2]))))
+                    lines.append('%s_count%s %d' % (name, fmt(l), h[-1]))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        def key(name, labels): return name + ''.join('/%s=%s' % x for x in labels)
+        with self.lock:
+            return {'time': time.time(),
+                    'counters': dict((key(n, l), v) for (n, l), v in self.counters.items()),
+                    'gauges': dict((key(n, l), v) for (n, l), v in self.gauges.items()),
+                    'histograms': dict((key(n, l), {'buckets': dict(zip(map(str, self.buckets), h)),
+                                                    'sum': h[-2], 'count': h[-1]})
+                                       for (n, l), h in self.histograms.items())}
+
+METRICS = Metrics()
+inc, gauge, observe = METRICS.inc, METRICS.set, METRICS.observe
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics': body, ctype = METRICS.prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json': body, ctype = json.dumps(METRICS.snapshot()), 'application/json'
+        else: self.send_error(404); return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port, host='127.0.0.1'):
+    # /metrics and /metrics.json on a daemon thread
+    server = HTTPServer((host, port), MetricsHandler)
+    t = threading.Thread(target=server.serve_forever, name='Metrics')
+    t.daemon = True; t.start()
+    log.info('Metrics on http://%s:%d/metrics' % (host, port))
+    return server
+
+class MetricsDumper(threading.Thread):
+    # writes the snapshot to filename every interval seconds, replaced atomically
+    def __init__(self, filename, interval=10.0):
+        threading.Thread.__init__(self, name='MetricsDumper')
+        self.daemon = True
+        self.filename = filename
+        self.interval = interval
+        self.running = True
+
+    def dump(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f: json.dump(METRICS.snapshot(), f, sort_keys=True)
+        os.rename(tmp, self.filename)
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            try: self.dump()
+            except (IOError, OSError) as e: log.error('Metrics dump failed: %s' % e)
+
+    def stop(self):
+        self.running = False
+        self.dump()
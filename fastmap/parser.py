@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import logging
+
+from s2sphere import CellId
+
+from fastmap import dedup, metrics
+from fastmap.db import Cell, Fort, Spawn, Sighting, QueueStatus, QUEUE_DONE, QUEUE_EMPTY, QUEUE_FAILED
+from fastmap.utils import cell_geometry, cell_tokens, distance, set_bit
+
+log = logging.getLogger(__name__)
+
+# pokemon farther away than this from the scan position may just not be listed
+SIGHT_RANGE = 70
+
+
+def parse_response(cell, response_dict):
+    # GET_MAP_OBJECTS response -> (records, [cells, gyms, pokestops, spawns], answered),
+    # answered maps every map cell token of the response to its content, deduplicated or not
+    records = []
+    stats = [0, 0, 0, 0]
+    answered = {}
+
+    if not response_dict: return [QueueStatus(cell, QUEUE_FAILED, 0)], stats, answered
+
+    map_objects = response_dict['responses']['GET_MAP_OBJECTS']
+    if 'map_cells' not in map_objects: return [QueueStatus(cell, QUEUE_FAILED, 0)], stats, answered
+
+    spawns = []
+    sightings = {}
+    contents = 0
+    # objects recorded unchanged a moment ago by an overlapping response are skipped
+    cache = dedup.CACHE
+    for map_cell in map_objects['map_cells']:
+        cellid = CellId(map_cell['s2_cell_id']).to_token()
+        timestamp = int(map_cell['current_timestamp_ms']/1000)
+        stats[0] += 1
+        content = 0
+
+        for fort in map_cell.get('forts', ()):
+            if 'gym_points' in fort:
+                stats[1] += 1; content = set_bit(content, 2); fort_type = 0
+            else:
+                stats[2] += 1; content = set_bit(content, 1); fort_type = 1
+            if cache is not None and cache.seen(('f', fort['id']), timestamp, (int(fort['enabled']), fort_type)): continue
+            records.append(Fort(fort['id'], cellid, fort['latitude'], fort['longitude'],
+                                int(fort['enabled']), fort_type, timestamp))
+
+        for key in ('spawn_points', 'decimated_spawn_points'):
+            for spawn in map_cell.get(key, ()):
+                content = set_bit(content, 0)
+                spawns.append((spawn['latitude'], spawn['longitude'], cellid, timestamp))
+
+        for key in ('wild_pokemons', 'catchable_pokemons'):
+            for pokemon in map_cell.get(key, ()):
+                if 'spawn_point_id' not in pokemon: continue
+                tth = pokemon.get('time_till_hidden_ms', 0)
+                if not 0 < tth <= 3600000: tth = pokemon.get('expiration_timestamp_ms', 0) - map_cell['current_timestamp_ms']
+                despawn = (map_cell['current_timestamp_ms'] + tth) / 1000 % 3600 if 0 < tth <= 3600000 else None
+                # spawn id -> (timestamp of its own map cell, despawn), a known despawn wins
+                if sightings.get(pokemon['spawn_point_id'], (None, None))[1] is None:
+                    sightings[pokemon['spawn_point_id']] = (timestamp, despawn)
+
+        if cache is None or not cache.seen(('c', cellid), timestamp, content): records.append(Cell(cellid, content, timestamp))
+        answered[cellid] = content; contents |= content
+
+    # spawn ids of the whole response in one go, known ones come from the cache
+    if spawns: scanlat, scanlng = cell_geometry(cell)[:2]
+    stats[3] = len(spawns)
+    ids = [cache.get(('s',) + x[:2], x[3]) for x in spawns] if cache is not None else [None] * len(spawns)
+    new = [k for k, x in enumerate(ids) if x is None]
+    for k, spawn_id in zip(new, cell_tokens([spawns[k][:2] for k in new], 20)):
+        ids[k] = spawn_id
+        lat, lng, cellid, timestamp = spawns[k]
+        records.append(Spawn(spawn_id, cellid, lat, lng, timestamp))
+        if cache is not None: cache.put(('s', lat, lng), timestamp, spawn_id)
+    for spawn_id, (lat, lng, cellid, timestamp) in zip(ids, spawns):
+        # an empty spawn point in sight counts as absent at this minute
+        if spawn_id not in sightings and distance(lat, lng, scanlat, scanlng) <= SIGHT_RANGE:
+            records.append(Sighting(spawn_id, timestamp, 0, None))
+    for spawn_id, (timestamp, despawn) in sightings.iteritems():
+        records.append(Sighting(spawn_id, timestamp, 1, despawn))
+
+    if cache is not None: metrics.gauge('fastmap_dedup_hit_rate', cache.rate())
+    log.debug('%s: ' % cell + '%d Cells, %d Gyms, %d Pokestops, %d Spawns.' % tuple(stats))
+    records.append(QueueStatus(cell, QUEUE_DONE if stats[1]+stats[2]+stats[3] > 0 else QUEUE_EMPTY, contents))
+    return records, stats, answered
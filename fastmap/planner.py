@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+scan points for urban spawn scanning: a greedy set cover of the known
+spawns and forts by circles of the visibility radius
+"""
+
+import math
+import heapq
+import logging
+
+from collections import defaultdict
+
+from fastmap.db import queue_cells
+from fastmap.parser import SIGHT_RANGE
+from fastmap.query import query_bbox, query_radius
+from fastmap.utils import EARTH, cell_tokens
+
+log = logging.getLogger(__name__)
+
+# scan points are queued as cells of this level, about 1m across
+POINT_LEVEL = 24
+
+
+def load_points(db, lat=None, lng=None, radius=None, bbox=None):
+    # (lat, lng) of all spawns and forts, or those around lat, lng / inside bbox
+    points = []
+    for table in ('spawns', 'forts'):
+        if radius is not None: found = [(x.pos_lat, x.pos_lng) for x in query_radius(db, lat, lng, radius, table)]
+        elif bbox is not None: found = [(x.pos_lat, x.pos_lng) for x in query_bbox(db, *bbox, table=table)]
+        else: found = db.execute("SELECT pos_lat, pos_lng FROM %s" % table).fetchall()
+        points.extend(found)
+    return points
+
+def plan_scan_points(latlngs, radius=SIGHT_RANGE):
+    # lazy greedy: take the point whose circle holds the most uncovered points,
+    # neighbours are looked up on a grid of radius sized buckets
+    if len(latlngs) == 0: return []
+    ky = math.radians(1) * EARTH
+    kx = ky * math.cos(math.radians(sum(x[0] for x in latlngs) / len(latlngs)))
+    xy = [(lng * kx, lat * ky) for lat, lng in latlngs]
+    grid = defaultdict(list)
+    for i, (x, y) in enumerate(xy): grid[int(x // radius), int(y // radius)].append(i)
+    r2 = radius * radius
+
+    def buckets(i):
+        gx, gy = int(xy[i][0] // radius), int(xy[i][1] // radius)
+        return [(gx + dx, gy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (gx + dx, gy + dy) in grid]
+
+    def near(i):
+        x, y = xy[i]
+        return [j for key in buckets(i) for j in grid[key] if (xy[j][0] - x) ** 2 + (xy[j][1] - y) ** 2 <= r2]
+
+    # buckets only hold uncovered points and the 3x3 buckets around a point bound
+    # its count from above, which is all lazy greedy needs
+    heap = [(-sum(len(grid[key]) for key in buckets(i)), i) for i in xrange(len(xy))]
+    heapq.heapify(heap)
+    covered = bytearray(len(xy))
+    chosen = []
+    while heap:
+        count, i = heapq.heappop(heap)
+        todo = near(i)
+        if len(todo) == 0: continue
+        if len(todo) < -count: heapq.heappush(heap, (-len(todo), i)); continue
+        for j in todo: covered[j] = 1
+        for key in buckets(i): grid[key] = [j for j in grid[key] if not covered[j]]
+        chosen.append(latlngs[i])
+    return chosen
+
+def queue_scan_points(db, latlngs, level=POINT_LEVEL):
+    # the points go into the queue as fine cells, sorted so they are claimed along the Hilbert curve
+    cells = sorted(set(cell_tokens(latlngs, level)))
+    with db: inserted = queue_cells(db, ((cell, level) for cell in cells))
+    return inserted, len(cells) - inserted
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import threading
+
+from Queue import Queue, Empty
+
+from fastmap.apiwrap import api_init, AccountBannedException
+
+log = logging.getLogger(__name__)
+
+
+class AccountPool(object):
+    # logs accounts in in parallel, keeps a few logged in spares and
+    # renews sessions in the background before they expire
+    def __init__(self, accounts, spares=2, parallel=8, refresh=1500, cache=None):
+        self.accounts = list(accounts)
+        self.spares = spares
+        self.parallel = parallel
+        self.refresh = refresh
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.idle = []          # (api, account) logged in spares
+        self.fresh = {}         # username -> renewed api, picked up by its worker
+        self.renew = {}         # username -> time its session is renewed
+        self.dead = set()
+        self.running = False
+
+    def _login(self, account, reuse=True):
+        try: api = api_init(account, self.cache if reuse else None)
+        except AccountBannedException: api = None
+        except Exception as e: log.error('Login for %s failed: %r' % (account.username, e)); api = None
+        if api is None:
+            if self.cache is not None: self.cache.invalidate(account)
+            with self.lock: self.dead.add(account.username); self.renew.pop(account.username, None)
+            return None
+
+        renew = time.time() + self.refresh
+        if self.cache is not None:
+            if not reuse: self.cache.put(account, api)
+            expires = self.cache.expires(account)
+            if expires > 0: renew = min(renew, expires - 300)
+        with self.lock: self.renew[account.username] = renew
+        return api
+
+    def _unused(self):
+        with self.lock:
+            busy = self.dead | set(self.renew)
+            return [a for a in self.accounts if a.username not in busy]
+
+    def login(self, n):
+        # returns up to n logged in (api, account) pairs, further
+        # successful logins become spares
+        todo = Queue()
+        for account in self._unused(): todo.put(account)
+        ready = []
+
+        def run():
+            while True:
+                with self.lock:
+                    if len(ready) >= n + self.spares: return
+                try: account = todo.get_nowait()
+                except Empty: return
+                api = self._login(account)
+                if api is not None:
+                    with self.lock: ready.append((api, account))
+                    log.info("Logged into  '%s'" % account.username)
+                else: log.error("Login failed for  '%s'" % account.username)
+
+        threads = [threading.Thread(target=run) for dummy in xrange(self.parallel)]
+        for t in threads: t.daemon = True; t.start()
+        for t in threads: t.join()
+
+        with self.lock: self.idle.extend(ready[n:])
+        return ready[:n]
+
+    def replace(self, account, banned=True):
+        # returns a spare (api, account) or None, a banned account is
+        # retired, others are logged in again as spares in the background
+        if self.cache is not None: self.cache.invalidate(account)
+        with self.lock:
+            if banned: self.dead.add(account.username)
+            self.renew.pop(account.username, None); self.fresh.pop(account.username, None)
+            spare = self.idle.pop(0) if len(self.idle) > 0 else None
+        if spare is not None: log.info("Swapped '%s' for spare '%s'" % (account.username, spare[1].username))
+        return spare
+
+    def refreshed(self, account):
+        # a renewed session for account, if the refresher made one
+        with self.lock: return self.fresh.pop(account.username, None)
+
+    def start(self):
+        self.running = True
+        t = threading.Thread(target=self._run, name='AccountPool')
+        t.daemon = True; t.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            # top up the spares
+            with self.lock: missing = self.spares - len(self.idle)
+            if missing > 0 and len(self._unused()) > 0:
+                todo = self._unused()[:missing]
+                for account in todo:
+                    api = self._login(account)
+                    if api is not None:
+                        with self.lock: self.idle.append((api, account))
+            # renew sessions that are about to expire
+            with self.lock:
+                due = set(u for u, t in self.renew.items() if time.time() > t and u not in self.fresh)
+            for account in [a for a in self.accounts if a.username in due]:
+                api = self._login(account, reuse=False)
+                if api is None: continue
+                with self.lock:
+                    if account.username in self.dead: continue
+                    spares = [a.username for dummy, a in self.idle]
+                    if account.username in spares: self.idle[spares.index(account.username)] = (api, account)
+                    else: self.fresh[account.username] = api
+            time.sleep(5)
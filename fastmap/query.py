@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+area lookups over forts and spawns through the R*Trees of create_spatial_index,
+results are Fort / Spawn records
+"""
+
+import math
+import logging
+
+from s2sphere import Cell, CellId
+
+from fastmap.db import Fort, Spawn
+from fastmap.utils import EARTH, distance, latlng_cell_ids
+
+log = logging.getLogger(__name__)
+
+TABLES = {'forts': (Fort, 'fort_id'), 'spawns': (Spawn, 'spawn_id')}
+
+
+def _select(db, table, south, west, north, east):
+    kind, key = TABLES[table]
+    # the R*Tree stores 32 bit floats rounded outwards, the exact test is on the table
+    sql = ("SELECT {2} FROM {0}_rtree r CROSS JOIN {0} t ON t.{1}=r.{1} "
+           "WHERE r.lat_min<=? AND r.lat_max>=? AND r.lng_min<=? AND r.lng_max>=? "
+           "AND t.pos_lat BETWEEN ? AND ? AND t.pos_lng BETWEEN ? AND ?"
+           ).format(table, key, ', '.join('t.' + field for field in kind._fields))
+    return [kind(*row) for row in db.execute(sql, (north, south, east, west, south, north, west, east))]
+
+def query_bbox(db, south, west, north, east, table='spawns'):
+    # everything inside the box, west > east wraps around the antimeridian
+    if west > east:
+        return _select(db, table, south, west, north, 180.0) + _select(db, table, south, -180.0, north, east)
+    return _select(db, table, south, west, north, east)
+
+def query_radius(db, lat, lng, radius, table='spawns'):
+    # everything within radius meters, nearest first
+    delta = float(radius) / EARTH
+    south, north = max(-90.0, lat - math.degrees(delta)), min(90.0, lat + math.degrees(delta))
+    if south == -90.0 or north == 90.0 or math.sin(delta) >= math.cos(math.radians(lat)):
+        west, east = -180.0, 180.0
+    else:
+        dlng = math.degrees(math.asin(math.sin(delta) / math.cos(math.radians(lat))))
+        west, east = lng - dlng, lng + dlng
+        if west < -180.0: west += 360.0
+        if east > 180.0: east -= 360.0
+    near = [(distance(lat, lng, x.pos_lat, x.pos_lng), x) for x in query_bbox(db, south, west, north, east, table)]
+    return [x for d, x in sorted(near, key=lambda y: y[0]) if d <= radius]
+
+def query_cell(db, token, table='spawns'):
+    # everything inside the S2 cell of token, any level
+    cell = CellId.from_token(token)
+    rect = Cell(cell).get_rect_bound()
+    found = query_bbox(db, rect.lat_lo().degrees, rect.lng_lo().degrees, rect.lat_hi().degrees, rect.lng_hi().degrees, table)
+    first, last = cell.range_min().id(), cell.range_max().id()
+    leafs = latlng_cell_ids([(x.pos_lat, x.pos_lng) for x in found], 30)
+    return [x for x, leaf in zip(found, leafs) if first <= leaf <= last]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+adaptive refinement: a coarse queue cell whose answer came back clipped is
+split into finer queue cells, but only where something is or may be,
+children whose visible part was all empty are retired
+"""
+
+import logging
+
+from s2sphere import CellId
+
+from fastmap.db import QueueStatus, QUEUE_FAILED, QUEUE_REFINED, queue_cells
+from fastmap.utils import cell_children, id_tokens, sub_cells, susub_cells
+
+log = logging.getLogger(__name__)
+
+# map cells are requested at this level, queue cells are not split finer
+MAP_LEVEL = 15
+
+
+def refine_cell(token, records, answered, level=MAP_LEVEL):
+    # child CellIds of a scanned queue cell that deserve a scan of their own, answered
+    # holds the content of every map cell in the response, the records may lack the
+    # Cell records skipped as duplicates
+    cell = CellId.from_token(token)
+    if cell.level() >= level: return []
+    status = [x for x in records if type(x) is QueueStatus]
+    if len(status) == 0 or status[0].scan_status == QUEUE_FAILED: return []
+
+    content = answered
+    requested = len(cell_children(cell, level))
+    if len(content) >= requested: return []
+
+    # far less than a quarter answered, go down two levels at once
+    children = susub_cells(cell) if 4 * len(content) < requested and cell.level() + 2 <= level else sub_cells(cell)
+    refined = []
+    for child in children:
+        tokens = id_tokens(cell_children(child, level))
+        seen = [content[x] for x in tokens if x in content]
+        if len(seen) == len(tokens): continue                   # fully answered already
+        if len(seen) > 0 and not any(seen): continue            # what was in sight is empty
+        refined.append(child)
+    return refined
+
+def queue_children(db, token, children):
+    # new pending queue cells, returns how many were not queued before; the parent
+    # is marked refined, so rescans and --due go to the children only
+    if len(children) == 0: return 0
+    with db:
+        db.execute("UPDATE _queue SET scan_status=? WHERE cell_id=?", (QUEUE_REFINED, token))
+        return queue_cells(db, ((x.to_token(), x.level()) for x in children))
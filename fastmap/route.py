@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+per-account routes: the cells are cut into contiguous pieces of the S2
+Hilbert curve, each walked nearest neighbour first and shortened by 2-opt
+"""
+
+import logging
+
+from fastmap.utils import cell_geometry, distance
+
+log = logging.getLogger(__name__)
+
+
+def hilbert_order(tokens):
+    # tokens sort like their cell ids, which run along the Hilbert curve
+    return sorted(tokens)
+
+def path_length(points, start=None):
+    if start is not None: points = [start] + list(points)
+    return sum(distance(a[0], a[1], b[0], b[1]) for a, b in zip(points, points[1:]))
+
+def path_time(points, delay, speed=None, start=None):
+    # seconds for one account, every step takes the delay or the walk, whichever is longer
+    if start is not None: points = [start] + list(points)
+    if speed is None: return delay * max(0, len(points) - 1)
+    return sum(max(delay, distance(a[0], a[1], b[0], b[1]) / speed) for a, b in zip(points, points[1:]))
+
+def nearest_neighbour(points, start=None):
+    # visiting order of points, always walking to the closest one left
+    left = range(len(points)); order = []
+    here = start if start is not None else points[0]
+    while left:
+        k = min(left, key=lambda i: distance(here[0], here[1], points[i][0], points[i][1]))
+        left.remove(k); order.append(k); here = points[k]
+    return order
+
+def two_opt(points, order, start=None, passes=4):
+    # open path, reverses segments as long as that makes it shorter
+    path = ([start] if start is not None else []) + [points[i] for i in order]
+    index = ([None] if start is not None else []) + list(order)
+    first = 1 if start is not None else 0
+    d = lambda a, b: distance(path[a][0], path[a][1], path[b][0], path[b][1])
+    for dummy in xrange(passes):
+        better = False
+        for i in xrange(1, len(path) - 1):
+            for j in xrange(i + 1, len(path)):
+                gain = d(i - 1, i) - d(i - 1, j)
+                if j + 1 < len(path): gain += d(j, j + 1) - d(i, j + 1)
+                if gain > 1e-6:
+                    path[i:j+1] = path[i:j+1][::-1]; index[i:j+1] = index[i:j+1][::-1]; better = True
+        if not better: break
+    return index[first:]
+
+def plan_routes(tokens, positions):
+    # one route per position (None for a fresh account), contiguous on the
+    # Hilbert curve and handed to the account that stands closest to it
+    tokens = hilbert_order(tokens)
+    n = len(positions)
+    pieces = [tokens[k * len(tokens) / n:(k + 1) * len(tokens) / n] for k in xrange(n)]
+    points = [[cell_geometry(t)[:2] for t in piece] for piece in pieces]
+
+    routes = [None] * n
+    free = range(n)
+    for k in sorted(xrange(n), key=lambda k: -len(pieces[k])):
+        if len(pieces[k]) == 0: break
+        placed = [i for i in free if positions[i] is not None]
+        if placed:
+            i = min(placed, key=lambda i: distance(positions[i][0], positions[i][1], points[k][0][0], points[k][0][1]))
+        else: i = free[0]
+        free.remove(i)
+        order = two_opt(points[k], nearest_neighbour(points[k], positions[i]), positions[i])
+        routes[i] = [pieces[k][j] for j in order]
+    return [route or [] for route in routes]
+
+def compare_routes(tokens, n, delay, speed=None):
+    # (km, hours) of the slowest account: round robin over the queue order vs. routed
+    tokens = hilbert_order(tokens)
+    result = []
+    for routes in ([tokens[i::n] for i in xrange(n)], plan_routes(tokens, [None] * n)):
+        paths = [[cell_geometry(t)[:2] for t in route] for route in routes]
+        result.append((max(path_length(p) for p in paths) / 1000, max(path_time(p, delay, speed) for p in paths) / 3600))
+    return result
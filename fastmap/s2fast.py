@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+S2 cell ids for whole arrays of points at once, bit for bit the same
+results as s2sphere (quadratic projection), needs numpy
+"""
+
+import math
+import binascii
+
+import numpy as np
+
+from s2sphere.sphere import LOOKUP_BITS, LOOKUP_POS, LOOKUP_IJ, SWAP_MASK, INVERT_MASK
+
+MAX_LEVEL = 30
+MAX_SIZE = 1 << MAX_LEVEL
+POS_BITS = 2 * MAX_LEVEL + 1
+
+_LOOKUP_POS = np.array(LOOKUP_POS, dtype=np.uint64)
+_LOOKUP_IJ = np.array(LOOKUP_IJ, dtype=np.uint64)
+_LOOKUP_MASK = np.uint64((1 << LOOKUP_BITS) - 1)
+_ORIENTATION_MASK = np.uint64(SWAP_MASK | INVERT_MASK)
+
+# same constants as math.radians / math.degrees
+_DEG_TO_RAD = math.pi / 180.0
+_RAD_TO_DEG = 180.0 / math.pi
+
+
+def _u64(value):
+    return np.uint64(value)
+
+def _uv_to_st(u):
+    r = 0.5 * np.sqrt(1 + 3 * np.abs(u))
+    return np.where(u >= 0, r, 1 - r)
+
+def _st_to_uv(s):
+    return np.where(s >= 0.5, (1.0 / 3.0) * (4 * s * s - 1), (1.0 / 3.0) * (1 - 4 * (1 - s) * (1 - s)))
+
+def _st_to_ij(s):
+    return np.clip(np.floor(MAX_SIZE * s), 0, MAX_SIZE - 1).astype(np.uint64)
+
+def _xyz_to_face_uv(x, y, z):
+    ax, ay, az = np.abs(x), np.abs(y), np.abs(z)
+    face = np.where(ax > ay, np.where(ax > az, 0, 2), np.where(ay > az, 1, 2))
+    neg = np.choose(face, (x, y, z)) < 0
+    face = face + 3 * neg
+
+    u = np.empty_like(x); v = np.empty_like(x)
+    for f, (nu, du, nv, dv, su, sv) in enumerate((
+            (y, x, z, x, 1, 1), (x, y, z, y, -1, 1), (x, z, y, z, -1, -1),
+            (z, x, y, x, 1, 1), (z, y, x, y, 1, -1), (y, z, x, z, -1, -1))):
+        m = face == f
+        if m.any():
+            u[m] = su * nu[m] / du[m]
+            v[m] = sv * nv[m] / dv[m]
+    return face, u, v
+
+def _face_uv_to_xyz(face, u, v):
+    one = np.ones_like(u)
+    x = np.choose(face, (one, -u, -u, -one, v, v))
+    y = np.choose(face, (u, one, -v, -v, -one, u))
+    z = np.choose(face, (v, v, one, -u, -u, -one))
+    return x, y, z
+
+def from_face_ij(face, i, j):
+    face = face.astype(np.uint64)
+    n = face << _u64(POS_BITS - 1)
+    bits = face & _u64(SWAP_MASK)
+    for k in xrange(7, -1, -1):
+        shift = _u64(k * LOOKUP_BITS)
+        bits = bits + (((i >> shift) & _LOOKUP_MASK) << _u64(LOOKUP_BITS + 2))
+        bits = bits + (((j >> shift) & _LOOKUP_MASK) << _u64(2))
+        bits = _LOOKUP_POS[bits.astype(np.intp)]
+        n |= (bits >> _u64(2)) << _u64(k * 2 * LOOKUP_BITS)
+        bits &= _ORIENTATION_MASK
+    return n * _u64(2) + _u64(1)
+
+def leaf_ids(lat, lng):
+    # lat/lng in degrees -> uint64 leaf cell ids, like CellId.from_lat_lng()
+    phi = np.asarray(lat, dtype=np.float64).reshape(-1) * _DEG_TO_RAD
+    theta = np.asarray(lng, dtype=np.float64).reshape(-1) * _DEG_TO_RAD
+    cosphi = np.cos(phi)
+    face, u, v = _xyz_to_face_uv(np.cos(theta) * cosphi, np.sin(theta) * cosphi, np.sin(phi))
+    return from_face_ij(face, _st_to_ij(_uv_to_st(u)), _st_to_ij(_uv_to_st(v)))
+
+def parent_ids(ids, level):
+    lsb = _u64(1 << (2 * (MAX_LEVEL - level)))
+    return (ids & ~(lsb - _u64(1))) | lsb
+
+def cell_ids(lat, lng, level=MAX_LEVEL):
+    ids = leaf_ids(lat, lng)
+    if level < MAX_LEVEL: ids = parent_ids(ids, level)
+    return ids
+
+def to_tokens(ids):
+    # hex ids with the right zeros stripped, like CellId.to_token()
+    h = binascii.hexlify(np.ascontiguousarray(ids, dtype='>u8').tobytes()).decode('ascii')
+    return [h[k:k+16].rstrip('0') for k in xrange(0, len(h), 16)]
+
+def to_face_ij(ids):
+    ids = np.asarray(ids, dtype=np.uint64).reshape(-1)
+    face = ids >> _u64(POS_BITS)
+    bits = face & _u64(SWAP_MASK)
+    i = np.zeros_like(ids); j = np.zeros_like(ids)
+    for k in xrange(7, -1, -1):
+        nbits = MAX_LEVEL - 7 * LOOKUP_BITS if k == 7 else LOOKUP_BITS
+        bits = bits + (((ids >> _u64(k * 2 * LOOKUP_BITS + 1)) & _u64((1 << (2 * nbits)) - 1)) << _u64(2))
+        bits = _LOOKUP_IJ[bits.astype(np.intp)]
+        i += (bits >> _u64(LOOKUP_BITS + 2)) << _u64(k * LOOKUP_BITS)
+        j += ((bits >> _u64(2)) & _LOOKUP_MASK) << _u64(k * LOOKUP_BITS)
+        bits &= _ORIENTATION_MASK
+    return face.astype(np.intp), i, j
+
+def centres(ids):
+    # cell centres in degrees, like CellId.to_lat_lng()
+    ids = np.asarray(ids, dtype=np.uint64).reshape(-1)
+    face, i, j = to_face_ij(ids)
+    lsb = ids & (~ids + _u64(1))
+    delta = np.where(lsb == 1, 1, np.where(((i ^ (ids >> _u64(2))) & _u64(1)) != 0, 2, 0)).astype(np.uint64)
+    si = (_u64(2) * i + delta).astype(np.float64)
+    ti = (_u64(2) * j + delta).astype(np.float64)
+    x, y, z = _face_uv_to_xyz(face, _st_to_uv((0.5 / MAX_SIZE) * si), _st_to_uv((0.5 / MAX_SIZE) * ti))
+    lat = np.arctan2(z, np.sqrt(x * x + y * y)) * _RAD_TO_DEG
+    lng = np.arctan2(y, x) * _RAD_TO_DEG
+    return lat, lng
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import logging
+import multiprocessing
+
+from Queue import Empty
+
+from fastmap.pool import AccountPool
+from fastmap.authcache import AuthCache
+from fastmap.engine import ScanEngine, WindowEngine
+from fastmap.db import ScanHistory
+from fastmap.metrics import serve, MetricsDumper
+from fastmap import dedup
+
+log = logging.getLogger(__name__)
+
+
+class ShardProcess(multiprocessing.Process):
+    # logs in its slice of the accounts, scans and parses the cells it is
+    # sent, results go back as (shard, cell, records, stats)
+    def __init__(self, shard, accounts, workers, delay, min_delay, spares, authcache, results, history=None,
+                 speed=None, route=False, metrics=(None, None), window=None):
+        multiprocessing.Process.__init__(self, name='Shard%02d' % shard)
+        self.daemon = True
+        self.shard = shard
+        self.accounts = accounts
+        self.workers = workers
+        self.spares = spares
+        self.authcache = authcache
+        self.history = history
+        self.speed = speed
+        self.route = route
+        self.metrics = metrics
+        self.window = window
+        self.delay = delay
+        self.min_delay = min_delay
+        self.tasks = multiprocessing.Queue()
+        self.results = results
+        self.closing = False
+
+    def run(self):
+        # every shard has its own metrics, on the next ports and files
+        port, filename = self.metrics
+        if port: serve(port + 1 + self.shard)
+        dumper = MetricsDumper('%s.%d' % (filename, self.shard)) if filename else None
+        if dumper: dumper.start()
+
+        pool = AccountPool(self.accounts, self.spares, cache=AuthCache(self.authcache) if self.authcache else None)
+        logged = pool.login(self.workers)
+        log.info('Shard %d: %d Workers.' % (self.shard, len(logged)))
+
+        since = ScanHistory(self.history).timestamps if self.history else None
+        apis, logins = [x[0] for x in logged], [x[1] for x in logged]
+        if self.window: engine = WindowEngine(self.window, apis, logins, self.delay, self.min_delay, pool, since, self.speed)
+        else: engine = ScanEngine(apis, logins, self.delay, self.min_delay, pool, since, self.speed)
+        engine.start(); pool.start()
+        inflight, closing = 0, False
+        try:
+            while engine.alive() > 0:
+                cells = []
+                while not closing:
+                    try: cell = self.tasks.get_nowait()
+                    except Empty: break
+                    if cell is None: closing = True
+                    else: cells.append(cell)
+                if cells:
+                    if self.route: engine.route(cells)
+                    else: engine.put(cells)
+                    inflight += len(cells)
+
+                if closing and inflight == 0: break
+
+                result = engine.get(0.5)
+                if result is None: continue
+                self.results.put((self.shard,) + result); inflight -= 1
+        except KeyboardInterrupt: pass
+        finally:
+            engine.stop(); pool.stop()
+            if dumper: dumper.stop()
+            dedup.report()
+            self.results.put((self.shard, None, None, None, None))
+
+    def put(self, cells):
+        for cell in cells: self.tasks.put(cell)
+
+    def close(self):
+        self.tasks.put(None); self.closing = True
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+spawn time classification from the _spawnlog minute masks,
+only spawns with new sightings are estimated again
+"""
+
+import time
+import logging
+
+from fastmap.db import QUEUE_PENDING, QUEUE_RESCANNABLE, queue_cells, status_sql
+from fastmap.planner import POINT_LEVEL, plan_scan_points
+from fastmap.utils import cell_tokens
+
+log = logging.getLogger(__name__)
+
+DURATIONS = (15, 30, 60)
+STATIC_HITS = 3
+
+
+def _minutes(mask):
+    return [m for m in xrange(60) if mask >> m & 1]
+
+def estimate_window(seen, absent, despawn=None):
+    # (spawn_time_base, spawn_time_offset, spawn_time_dur) in seconds of the hour,
+    # base is the earliest possible start, offset how much later it may really be
+    minutes = _minutes(seen)
+    if len(minutes) == 0: return None
+    absent &= ~seen
+
+    if len(minutes) == 1: first, span = minutes[0], 1
+    else:
+        # the shortest arc over all seen minutes starts behind the largest gap
+        gap, k = max(((minutes[(k + 1) % len(minutes)] - m) % 60, k) for k, m in enumerate(minutes))
+        first, span = minutes[(k + 1) % len(minutes)], 61 - gap
+    dur = min(d for d in DURATIONS if d >= span)
+
+    if despawn is not None:
+        return (despawn - dur * 60) % 3600, 0, dur * 60
+
+    # move the start back over minutes not known to be empty
+    early = 0
+    while early < dur - span and not absent >> ((first - early - 1) % 60) & 1: early += 1
+    return (first - early) % 60 * 60, early * 60, dur * 60
+
+def update_spawn_times(db, chunksize=10000):
+    # estimates every spawn with new sightings, chunk by chunk, and writes back in bulk
+    n = 0
+    while True:
+        rows = db.execute("SELECT spawn_id, seen, absent, despawn, hits FROM _spawnlog WHERE dirty=1 "
+                          "ORDER BY spawn_id LIMIT ?", (chunksize,)).fetchall()
+        if len(rows) == 0: break
+        updates = []
+        for spawn_id, seen, absent, despawn, hits in rows:
+            window = estimate_window(seen, absent, despawn)
+            if window is not None: updates.append(window + (int(hits >= STATIC_HITS), spawn_id))
+        with db:
+            db.executemany("UPDATE spawns SET spawn_time_base=?, spawn_time_offset=?, spawn_time_dur=?, "
+                           "static_spawner=? WHERE spawn_id=?", updates)
+            db.executemany("UPDATE _spawnlog SET dirty=0 WHERE spawn_id=?", ((x[0],) for x in rows))
+        n += len(updates)
+    if n > 0: log.info('Spawn times of %d spawns updated.' % n)
+    return n
+
+def due_spawns(db, ahead=300, now=None):
+    # (spawn_id, lat, lng, base) of spawns starting within the next ahead seconds
+    second = int(now if now is not None else time.time()) % 3600
+    end = second + ahead
+    sql = "SELECT spawn_id, pos_lat, pos_lng, spawn_time_base FROM spawns WHERE spawn_time_base BETWEEN ? AND ?"
+    if end < 3600: return db.execute(sql, (second, end)).fetchall()
+    return db.execute(sql, (second, 3599)).fetchall() + db.execute(sql, (0, end - 3600)).fetchall()
+
+def queue_due_spawns(db, ahead=300, level=POINT_LEVEL, now=None):
+    # puts scan points covering the due spawns into the scan queue, returns their count;
+    # a spawn is only in sight within SIGHT_RANGE of the scan position, far less than a cell
+    due = due_spawns(db, ahead, now)
+    cells = sorted(set(cell_tokens(plan_scan_points([x[1:3] for x in due]), level)))
+    with db:
+        queue_cells(db, ((cell, level) for cell in cells))
+        db.executemany("UPDATE _queue SET scan_status=%d WHERE cell_id=? AND %s" % (QUEUE_PENDING, status_sql(*QUEUE_RESCANNABLE)),
+                       ((cell,) for cell in cells))
+    return len(cells)
@@ -3,6 +3,10 @@
 import re
 import math
 import logging
+import threading
+
+from array import array
+from collections import OrderedDict
 
 from geopy.geocoders import GoogleV3
 from geographiclib.geodesic import Geodesic
@@ -10,8 +14,17 @@ from s2sphere import CellId, Angle, LatLng, LatLngRect, Cap, RegionCoverer
 
 from fastmap.apiwrap import PoGoAccount
 
+try: from fastmap import s2fast
+except ImportError: s2fast = None
+
 log = logging.getLogger(__name__)
 
+EARTH = 6371000
+
+# compact storage for cell ids, array('Q') needs python 3
+try: array('Q'); IDTYPE = 'Q'
+except ValueError: IDTYPE = 'L' if array('L').itemsize == 8 else None
+
 
 
 def set_bit(value, bit):
@@ -91,6 +104,74 @@ def get_cell_edges(cell, level=30):
     
     return edge_cells
     
+def cell_children(cell, level=15):
+    # ids of all descendants at level, sorted - same as get_cell_ids(sub_cells_normalized(cell, level))
+    if cell.level() >= level: return id_array([cell.id()])
+    begin = cell.child_begin(level).id()
+    step = CellId.lsb_for_level(level) << 1
+    return id_array([begin + i * step for i in xrange(1 << 2 * (level - cell.level()))])
+
+def id_array(ids):
+    return array(IDTYPE, ids) if IDTYPE else list(ids)
+
+class LRUCache(object):
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        with self.lock:
+            try: value = self.items.pop(key)
+            except KeyError: self.misses += 1; return None
+            self.items[key] = value; self.hits += 1
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.maxsize: self.items.popitem(last=False)
+
+_geometry = LRUCache()
+
+def cell_geometry(token, level=15):
+    # (lat, lng, child ids) of a queue cell, computed once per cell,
+    # finer cells are scan points and get their cell at level and its neighbours
+    geometry = _geometry.get((token, level))
+    if geometry is None:
+        cell = CellId.from_token(token)
+        latlng = cell.to_lat_lng()
+        if cell.level() > level:
+            parent = cell.parent(level)
+            ids = id_array(sorted([parent.id()] + [x.id() for x in parent.get_all_neighbors(level)]))
+        else: ids = cell_children(cell, level)
+        geometry = (latlng.lat().degrees, latlng.lng().degrees, ids)
+        _geometry.put((token, level), geometry)
+    return geometry
+
+def latlng_cell_ids(latlngs, level=15):
+    # ids of the level cells containing each (lat, lng)
+    if len(latlngs) == 0: return []
+    if s2fast is not None:
+        lat, lng = zip(*latlngs)
+        return [int(x) for x in s2fast.cell_ids(lat, lng, level)]
+    return [CellId.from_lat_lng(LatLng.from_degrees(lat, lng)).parent(level).id() for lat, lng in latlngs]
+
+def cell_tokens(latlngs, level=20):
+    # tokens of the level cells containing each (lat, lng), in bulk if numpy is installed
+    if len(latlngs) == 0: return []
+    if s2fast is not None:
+        lat, lng = zip(*latlngs)
+        return s2fast.to_tokens(s2fast.cell_ids(lat, lng, level))
+    return [CellId.from_lat_lng(LatLng.from_degrees(lat, lng)).parent(level).to_token() for lat, lng in latlngs]
+
+def id_tokens(ids):
+    if len(ids) == 0: return []
+    if s2fast is not None: return s2fast.to_tokens(ids)
+    return [CellId(x).to_token() for x in ids]
+
 def get_cell_ids(cells):
     cell_ids = sorted([x.id() for x in cells])
     return cell_ids
@@ -132,19 +213,32 @@ def get_cell_walk(lat, lng, radius, level=15):
         left = left.prev()
     return sorted(walk)
 
-def cell_spiral(lat, lng, dist, level=15, step=100, res=3.6):
-    cells = []
+def ring_points(lat, lng, radius, n=100):
+    # n points on the circle of radius meters around lat, lng (spherical earth)
+    phi, lam, delta = math.radians(lat), math.radians(lng), float(radius) / EARTH
+    points = []
+    for k in xrange(n):
+        theta = math.radians(k * 360.0 / n)
+        phi2 = math.asin(math.sin(phi) * math.cos(delta) + math.cos(phi) * math.sin(delta) * math.cos(theta))
+        lam2 = lam + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi),
+                                math.cos(delta) - math.sin(phi) * math.sin(phi2))
+        points.append((math.degrees(phi2), math.degrees(lam2)))
+    return points
+
+def distance(lat1, lng1, lat2, lng2):
+    # great circle distance in meters (haversine, spherical earth)
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH * math.asin(min(1.0, math.sqrt(a)))
 
-    g = Geodesic.WGS84  # @UndefinedVariable
-    
+def cell_spiral(lat, lng, dist, level=15, step=100, res=3.6):
+    # yields every cell once, ring by ring from the centre outwards
+    seen = set()
     for i in xrange(0,dist,step):
-        for rad in xrange(int(360/res)):
-            p = g.Direct(lat, lng, rad*res, i)
-            c = CellId.from_lat_lng(LatLng.from_degrees(p['lat2'],p['lon2']))
-            c = c.parent(level)
-            if c not in cells: cells.append(c)
-    
-    return cells
+        for cell_id in latlng_cell_ids(ring_points(lat, lng, i, int(360/res)), level):
+            if cell_id not in seen:
+                seen.add(cell_id)
+                yield CellId(cell_id)
 
 class cell_neighbor:
     def __init__(self, cell):
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+new, changed and deleted forts and spawns as newline-delimited JSON,
+one change per line in seq order, tails the database with --follow
+
+    feed.py db.sqlite --since 0
+    feed.py db.sqlite --cursorfile feed.cursor --follow | map-updater
+"""
+
+import os, sys, json, time
+import argparse
+
+from fastmap.db import check_db, connect, changes_since
+
+
+def load_cursor(filename):
+    if filename is None or not os.path.isfile(filename): return 0
+    with open(filename) as f: return int(f.read().strip() or 0)
+
+def save_cursor(filename, cursor):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f: f.write('%d\n' % cursor)
+    os.rename(tmp, filename)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbfile", help="DB filename", nargs='?', default='db.sqlite')
+    parser.add_argument("--since", help="last seq already seen", type=int)
+    parser.add_argument("--cursorfile", help="keeps the last seq written between runs")
+    parser.add_argument("-f", "--follow", help="keep polling for new changes", action='store_true')
+    parser.add_argument("--interval", help="seconds between polls", default=1.0, type=float)
+    args = parser.parse_args()
+
+    if not check_db(args.dbfile): raise SystemExit(1)
+    db = connect(args.dbfile)
+    cursor = args.since if args.since is not None else load_cursor(args.cursorfile)
+
+    try:
+        while True:
+            last = cursor
+            for change in changes_since(db, cursor):
+                sys.stdout.write(json.dumps(change, sort_keys=True) + '\n'); cursor = change['seq']
+            if cursor != last:
+                sys.stdout.flush()
+                if args.cursorfile: save_cursor(args.cursorfile, cursor)
+            if not args.follow: break
+            time.sleep(args.interval)
+    except (KeyboardInterrupt, IOError): pass
+    finally: db.close()
@@ -1,14 +1,59 @@
 #!/usr/bin/env python
+"""
+keeps db.sqlite compact while bootstrap.py is running: prunes what aged out,
+frees pages in small incremental steps and refreshes the planner statistics
+
+    vacuum.py db.sqlite --queue 30 --stale 14
+    vacuum.py db.sqlite --loop 600
+    vacuum.py db.sqlite --full
+"""
+
+import time, math
+import argparse, logging
+
+from fastmap.db import check_db, connect
+from fastmap.maintenance import maintain, enable_incremental
+
+log = logging.getLogger(__name__)
+
+DAY = 86400
+
+
+def seconds(days):
+    # None leaves pruning off, any positive age is at least one second
+    return None if days is None else int(math.ceil(days * DAY))
 
-import sys, sqlite3
 
 if __name__ == '__main__':
-    
-    dbfilename = 'db.sqlite'
-    if len(sys.argv) > 1: dbfilename = sys.argv[1]
-    
-    with sqlite3.connect(dbfilename) as db:
-        
-        db.cursor().execute("VACUUM")
-        
-    print('Donezo!')
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    logging.basicConfig(level=logging.INFO,\
+                        format='[%(levelname)5s] %(asctime)s %(message)s', datefmt="%d.%m.%y %H:%M:%S")
+    parser.add_argument("dbfile", help="DB filename", nargs='?', default='db.sqlite')
+    parser.add_argument("--queue", help="prune finished queue rows older than this many days", type=float)
+    parser.add_argument("--stale", help="prune forts and spawns not seen for this many days", type=float)
+    parser.add_argument("--pages", help="pages freed per step", default=256, type=int)
+    parser.add_argument("--pause", help="seconds between steps", default=0.05, type=float)
+    parser.add_argument("--analyze", help="full ANALYZE instead of PRAGMA optimize", action='store_true')
+    parser.add_argument("--loop", help="repeat every this many seconds", type=int)
+    parser.add_argument("--full", help="blocking full VACUUM, once, switches old files to incremental", action='store_true')
+    args = parser.parse_args()
+    for flag, days in (('--queue', args.queue), ('--stale', args.stale)):
+        if days is not None and days <= 0: parser.error('%s takes a positive number of days' % flag)
+
+    if not check_db(args.dbfile): raise SystemExit(1)
+    db = connect(args.dbfile)
+
+    if args.full:
+        log.info('Full VACUUM, scans are locked out until it is done...')
+        if enable_incremental(db): log.info('auto_vacuum is incremental now.')
+        else: db.execute("VACUUM")
+
+    try:
+        while True:
+            maintain(db, seconds(args.queue), seconds(args.stale), args.pages, args.pause, args.analyze)
+            if not args.loop: break
+            time.sleep(args.loop)
+    except KeyboardInterrupt: pass
+    finally: db.close()
+
+    print('Donezo!')